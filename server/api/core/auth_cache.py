@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from .config import settings
+from .metrics import REGISTRY
+
+
+class AuthCache:
+    """
+    Bounded LRU cache of authenticated users keyed by access token.
+    Entries expire after ttl seconds, or when the token expires if sooner.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # token -> (expires at, sub, user)
+        self._entries: "OrderedDict[str, Tuple[float, str, Any]]" = OrderedDict()
+        # sub -> tokens, for invalidation
+        self._tokens: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token: str) -> Optional[Any]:
+        """Return the user cached for token, None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    self._remove(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[2]
+
+    def set(
+        self, token: str, sub: str, user: Any, token_exp: Optional[int] = None
+    ) -> None:
+        """Cache user for token. token_exp is the exp claim of the token, if any."""
+        ttl = self.ttl
+        if token_exp is not None:
+            ttl = min(ttl, token_exp - time.time())
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (time.monotonic() + ttl, sub, user)
+            self._tokens.setdefault(sub, set()).add(token)
+
+            # evict the least recently used entries
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_user(self, sub: str) -> None:
+        """Drop every entry of the user identified by sub (the user's email)"""
+        with self._lock:
+            for token in list(self._tokens.get(sub, ())):
+                self._remove(token)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tokens.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, token: str) -> None:
+        _, sub, _ = self._entries.pop(token)
+        tokens = self._tokens[sub]
+        tokens.discard(token)
+        if not tokens:
+            del self._tokens[sub]
+
+
+auth_cache = AuthCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL)
+
+
+def collect_auth_cache() -> Iterable[dict]:
+    """Counters and size of the authenticated users cache"""
+    stats = auth_cache.stats()
+    metrics = {
+        "auth_cache_hits_total": (
+            "counter",
+            "Number of tokens found in the cache",
+            "hits",
+        ),
+        "auth_cache_misses_total": (
+            "counter",
+            "Number of tokens missing from the cache or expired",
+            "misses",
+        ),
+        "auth_cache_evictions_total": (
+            "counter",
+            "Number of entries evicted from the full cache",
+            "evictions",
+        ),
+        "auth_cache_size": ("gauge", "Number of entries in the cache", "size"),
+    }
+    for metric, (type, documentation, stat) in metrics.items():
+        yield {
+            "name": metric,
+            "type": type,
+            "help": documentation,
+            "labelnames": [],
+            "samples": [[[], stats[stat]]],
+        }
+
+
+REGISTRY.register_collector(collect_auth_cache)
@@ -1,4 +1,5 @@
 from turtle import st
+from typing import Optional
 from dotenv import dotenv_values
 from pydantic import BaseSettings
 
@@ -12,12 +13,105 @@ class Settings(BaseSettings):
 
     PROJECT_NAME: str = "Sales Automation"
 
+    # number of threads hashing and verifying passwords
+    PASSWORD_HASH_WORKERS: int = 2
+
+    # number of password hashes allowed to wait for a thread (503 beyond that)
+    PASSWORD_HASH_QUEUE_SIZE: int = 32
+
+    # authenticated users are cached per token for N seconds
+    AUTH_CACHE_TTL: float = 60.0
+
+    # maximum number of tokens in the authenticated users cache
+    AUTH_CACHE_SIZE: int = 10000
+
+    # connections kept open by each pool of the api, and extra connections
+    # opened under load
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+
+    # connections kept open by the pool of an import worker, and extra connections
+    IMPORT_DB_POOL_SIZE: int = 2
+    IMPORT_DB_MAX_OVERFLOW: int = 2
+
+    # seconds to wait for a free connection before failing
+    DB_POOL_TIMEOUT: float = 30.0
+
+    # connections are replaced after N seconds (-1 = never)
+    DB_POOL_RECYCLE: int = 1800
+
+    # test connections before handing them out
+    DB_POOL_PRE_PING: bool = True
+
     # maximum upload size (200MB)
     MAX_FILE_SIZE: int = 200 * 1024 * 1024
 
     # maximum number of rows in CSV file (1 million)
     MAX_NUMBER_OF_ROWS: int = 1000000
 
+    # number of rows persisted per statement, and between two checkpoints, of an import
+    PERSIST_BATCH_SIZE: int = 5000
+
+    # progress streams read the progress of the imports run by other processes
+    # every N seconds, and send a keep-alive comment after N seconds of silence
+    PROGRESS_STREAM_POLL_INTERVAL: float = 1.0
+    PROGRESS_STREAM_KEEPALIVE: float = 15.0
+
+    # number of processes parsing a CSV file (1 = parse in the calling process)
+    CSV_PARSE_WORKERS: int = 1
+
+    # files smaller than this are always parsed in the calling process (8MB)
+    CSV_PARALLEL_MIN_FILE_SIZE: int = 8 * 1024 * 1024
+
+    # number of byte ranges handed to each parse worker
+    CSV_RANGES_PER_WORKER: int = 4
+
+    # size of the cache of parsed imports, next to the CSV file store
+    # (1GB, 0 = disabled)
+    PARSED_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024
+
+    # maximum number of prospects sent in a single bulk request
+    BULK_MAX_PROSPECTS: int = 100000
+
+    # number of prospects read from the database per chunk of an export
+    EXPORT_BATCH_SIZE: int = 1000
+
+    # number of email domains whose validation result is cached
+    EMAIL_DOMAIN_CACHE_SIZE: int = 100000
+
+    # import workers poll the queue every N seconds when it is empty
+    IMPORT_POLL_INTERVAL: float = 1.0
+
+    # import workers record a heartbeat for their current job every N seconds
+    IMPORT_HEARTBEAT_INTERVAL: float = 10.0
+
+    # jobs without heartbeat for N seconds are requeued
+    IMPORT_STALE_AFTER: float = 60.0
+
+    # jobs attempted this many times, after crashes or errors, are marked failed
+    IMPORT_MAX_ATTEMPTS: int = 3
+
+    # jobs run at once by an import worker process, and jobs of a single user
+    # run at once by all the workers
+    IMPORT_WORKER_CONCURRENCY: int = 1
+    IMPORT_MAX_RUNNING_PER_USER: int = 2
+
+    # jobs a user can have waiting in the queue, further imports are refused
+    # and should be retried after N seconds
+    IMPORT_MAX_QUEUED_PER_USER: int = 10
+    IMPORT_RETRY_AFTER: int = 30
+
+    # directory where every process (uvicorn and import workers) shares its
+    # metrics, so that /metrics reports all of them (unset = this process only)
+    METRICS_DIR: Optional[str] = config.get("METRICS_DIR")
+
+    # token the internal endpoints (/internal/*, /metrics) require as a Bearer
+    # token, they are disabled (404) while it is unset
+    INTERNAL_TOKEN: Optional[str] = config.get("INTERNAL_TOKEN")
+
+    # processes write their metrics to METRICS_DIR every N seconds
+    METRICS_SNAPSHOT_INTERVAL: float = 5.0
+
     # CSV file store
     CSV_FILES_PATH: str = config.get("CSV_FILES_PATH")
 
@@ -27,6 +121,15 @@ class Settings(BaseSettings):
     # Buffer size
     BUFFER_SIZE = 1024
 
+    # Size of the chunks read from an upload while streaming it to disk (1MB)
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+
+    # Size of the chunks of a resumable upload (8MB)
+    UPLOAD_SESSION_CHUNK_SIZE: int = 8 * 1024 * 1024
+
+    # Resumable uploads receiving no chunk for N seconds are removed (1 day)
+    UPLOAD_SESSION_TTL: float = 24 * 60 * 60
+
     class Config:
         case_sensitive = True
 
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import time
+from typing import Dict, Iterable, Type
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+from .logger import log
+from .metrics import REGISTRY, Counter, Histogram
+
+POOL_WAIT = Histogram(
+    "db_pool_wait_seconds",
+    "Time spent waiting for a database connection",
+    ("pool",),
+)
+POOL_CHECKOUT_DURATION = Histogram(
+    "db_pool_checkout_duration_seconds",
+    "Time database connections stay checked out",
+    ("pool",),
+)
+POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts_total",
+    "Number of timeouts waiting for a database connection",
+    ("pool",),
+)
+
+# checked out connections of the named pools, by pool name:
+# connection record -> (checked out at, holder)
+holders: Dict[str, Dict[int, tuple]] = {}
+
+# instrumented engines, by pool name
+engines: Dict[str, Engine] = {}
+
+
+def instrumented(pool_class: Type[Pool]) -> Type[Pool]:
+    """Subclass a pool class to time the wait for a connection"""
+
+    class InstrumentedPool(pool_class):
+        def _do_get(self):
+            name = self._orig_logging_name
+            if name not in engines:
+                return super()._do_get()
+
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            except exc.TimeoutError:
+                POOL_TIMEOUTS.inc(labels=(name,))
+                report = pool_report()[name]
+                log.warning(
+                    f"Pool {name} timed out waiting for a connection: "
+                    f"{report['checked_out']} checked out by {report['holders']}"
+                )
+                raise
+            finally:
+                POOL_WAIT.observe(time.perf_counter() - start, labels=(name,))
+
+    InstrumentedPool.__name__ = f"Instrumented{pool_class.__name__}"
+    return InstrumentedPool
+
+
+def current_holder() -> str:
+    """Name the task (or thread) checking out a connection"""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return task.get_name()
+    return threading.current_thread().name
+
+
+def instrument_engine(engine: Engine, name: str) -> None:
+    """
+    Record the checkouts of an engine's pool under the given name. The pool must
+    be created with pool_logging_name=name and an instrumented pool class.
+    """
+    checked_out = holders[name] = {}
+    engines[name] = engine
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        checked_out[id(connection_record)] = (time.perf_counter(), current_holder())
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        holder = checked_out.pop(id(connection_record), None)
+        if holder is not None:
+            POOL_CHECKOUT_DURATION.observe(
+                time.perf_counter() - holder[0], labels=(name,)
+            )
+
+
+def pool_report() -> dict:
+    """Describe the state and the usage of every named pool"""
+    now = time.perf_counter()
+    timeouts = POOL_TIMEOUTS.samples()
+    report = {}
+    for name, engine in engines.items():
+        pool = engine.pool
+        report[name] = {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "timeouts": int(timeouts.get((name,), 0)),
+            "wait_time": POOL_WAIT.summary((name,)),
+            "checkout_duration": POOL_CHECKOUT_DURATION.summary((name,)),
+            "holders": [
+                {"holder": holder, "seconds": now - since}
+                for since, holder in list(holders[name].values())
+            ],
+        }
+    return report
+
+
+def collect_pools() -> Iterable[dict]:
+    """Gauges of the connections of every named pool"""
+    gauges = {
+        "db_pool_size": ("Number of connections kept open by the pool", "size"),
+        "db_pool_checked_out": ("Number of connections in use", "checkedout"),
+        "db_pool_overflow": (
+            "Number of connections opened beyond the size",
+            "overflow",
+        ),
+    }
+    for metric, (documentation, method) in gauges.items():
+        yield {
+            "name": metric,
+            "type": "gauge",
+            "help": documentation,
+            "labelnames": ["pool"],
+            "samples": [
+                [[name], getattr(engine.pool, method)()]
+                for name, engine in engines.items()
+            ],
+        }
+
+
+REGISTRY.register_collector(collect_pools)
@@ -0,0 +1,377 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .config import settings
+from .logger import log
+
+# default buckets (seconds) of latency histograms
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+class Metric:
+    """
+    A metric made of one value per combination of label values. Every thread
+    updates its own shard of the values, so that recording takes no lock; the
+    shards are summed when the metric is collected.
+    """
+
+    type = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Optional["Registry"] = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._shards_lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _shard(self) -> dict:
+        """The values of the calling thread, by label values"""
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._shards_lock:
+                self._shards.append(values)
+            return values
+
+    def samples(self) -> Dict[Labels, float]:
+        """Sum the shards of every thread"""
+        samples: Dict[Labels, float] = {}
+        for shard in list(self._shards):
+            for labels, value in list(shard.items()):
+                samples[labels] = samples.get(labels, 0.0) + value
+        return samples
+
+    def snapshot(self) -> dict:
+        return {
+            "type": self.type,
+            "help": self.documentation,
+            "labelnames": list(self.labelnames),
+            "samples": [
+                [list(labels), value] for labels, value in self.samples().items()
+            ],
+        }
+
+
+class Counter(Metric):
+    """A value which only goes up"""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, labels: Labels = ()) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0.0) + amount
+
+
+class Gauge(Metric):
+    """A value which goes up and down"""
+
+    type = "gauge"
+
+    def inc(self, amount: float = 1.0, labels: Labels = ()) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, labels: Labels = ()) -> None:
+        self.inc(-amount, labels)
+
+
+class Histogram(Metric):
+    """Counts observed values in buckets of upper bounds"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        registry: Optional["Registry"] = None,
+    ):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        shard = self._shard()
+        entry = shard.get(labels)
+        if entry is None:
+            # count of each bucket (and +Inf), sum, count
+            entry = shard[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self) -> Dict[Labels, list]:
+        samples: Dict[Labels, list] = {}
+        for shard in list(self._shards):
+            for labels, (counts, total, count) in list(shard.items()):
+                merged = samples.setdefault(labels, [[0] * len(counts), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+        return samples
+
+    def summary(self, labels: Labels = ()) -> dict:
+        """Return the cumulative count of each bucket, the sum and the count"""
+        counts, total, count = self.samples().get(
+            labels, [[0] * (len(self.buckets) + 1), 0.0, 0]
+        )
+        return {
+            "buckets": dict(
+                zip(map(str, self.buckets + (float("inf"),)), cumulate(counts))
+            ),
+            "sum": total,
+            "count": count,
+        }
+
+    def snapshot(self) -> dict:
+        snapshot = super().snapshot()
+        snapshot["buckets"] = list(self.buckets)
+        return snapshot
+
+
+class Registry:
+    """The metrics of a process, and callbacks collecting values at scrape time"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.collectors: List[Callable[[], Iterable[dict]]] = []
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self.metrics:
+            raise ValueError(f"Duplicate metric {metric.name}")
+        self.metrics[metric.name] = metric
+
+    def register_collector(self, collector: Callable[[], Iterable[dict]]) -> None:
+        """Register a callback returning metric snapshots, e.g. gauges read from a pool"""
+        self.collectors.append(collector)
+
+    def snapshot(self) -> Dict[str, dict]:
+        snapshot = {name: metric.snapshot() for name, metric in self.metrics.items()}
+        for collector in self.collectors:
+            for metric in collector():
+                snapshot[metric.pop("name")] = metric
+        return snapshot
+
+
+REGISTRY = Registry()
+
+
+def cumulate(counts: Sequence[int]) -> List[int]:
+    cumulative, result = 0, []
+    for count in counts:
+        cumulative += count
+        result.append(cumulative)
+    return result
+
+
+def is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def write_snapshot(registry: Registry = REGISTRY) -> None:
+    """
+    Write the metrics of this process to METRICS_DIR, where the metrics of all
+    the processes (uvicorn workers, import workers) are merged
+    """
+    if not settings.METRICS_DIR:
+        return
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    path = os.path.join(settings.METRICS_DIR, f"{os.getpid()}.json")
+    with open(f"{path}.tmp", "w") as snapshot_file:
+        json.dump(registry.snapshot(), snapshot_file)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_snapshots(registry: Registry = REGISTRY) -> List[Tuple[Dict[str, dict], bool]]:
+    """
+    The snapshots of every process with whether the process is alive, the one
+    of this process being taken now
+    """
+    if not settings.METRICS_DIR:
+        return [(registry.snapshot(), True)]
+
+    write_snapshot(registry)
+    snapshots = []
+    for file_name in os.listdir(settings.METRICS_DIR):
+        name, extension = os.path.splitext(file_name)
+        if extension != ".json" or not name.isdigit():
+            continue
+        try:
+            with open(os.path.join(settings.METRICS_DIR, file_name)) as snapshot_file:
+                snapshots.append((json.load(snapshot_file), is_alive(int(name))))
+        except (OSError, ValueError):
+            log.warning(f"Skipped unreadable metrics snapshot {file_name}")
+    return snapshots
+
+
+def merge(snapshots: List[Tuple[Dict[str, dict], bool]]) -> Dict[str, dict]:
+    """
+    Sum the metrics of several processes. The gauges of processes which
+    exited are dropped, their counters and histograms are kept.
+    """
+    merged: Dict[str, dict] = {}
+    for snapshot, alive in snapshots:
+        for name, metric in snapshot.items():
+            if metric["type"] == "gauge" and not alive:
+                continue
+            target = merged.setdefault(name, {**metric, "samples": {}})
+            for labels, value in metric["samples"]:
+                key = tuple(labels)
+                current = target["samples"].get(key)
+                if current is None:
+                    target["samples"][key] = value
+                elif metric["type"] == "histogram":
+                    target["samples"][key] = [
+                        [a + b for a, b in zip(current[0], value[0])],
+                        current[1] + value[1],
+                        current[2] + value[2],
+                    ]
+                else:
+                    target["samples"][key] = current + value
+    return merged
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def exposition(registry: Registry = REGISTRY) -> str:
+    """Render the metrics of every process in the text exposition format"""
+    lines = []
+    for name, metric in sorted(merge(read_snapshots(registry)).items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        labelnames = metric["labelnames"]
+        for labels, value in sorted(metric["samples"].items()):
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{format_labels(labelnames, labels)} {value}")
+                continue
+
+            counts, total, count = value
+            bounds = metric["buckets"] + ["+Inf"]
+            for bound, cumulative in zip(bounds, cumulate(counts)):
+                le = format_labels(labelnames, labels, f'le="{bound}"')
+                lines.append(f"{name}_bucket{le} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labelnames, labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labelnames, labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+class SnapshotWriter(threading.Thread):
+    """Periodically writes the metrics of this process to METRICS_DIR"""
+
+    def __init__(self, interval: float):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            try:
+                write_snapshot()
+            except OSError:
+                log.exception("Could not write the metrics snapshot")
+
+
+_writer: Optional[SnapshotWriter] = None
+
+
+def start_snapshot_writer() -> None:
+    """Share the metrics of this process with the other processes, if METRICS_DIR is set"""
+    global _writer
+    if settings.METRICS_DIR and _writer is None:
+        _writer = SnapshotWriter(settings.METRICS_SNAPSHOT_INTERVAL)
+        _writer.start()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the count, the latency and the in-flight requests"""
+
+    def __init__(self, app):
+        self.app = app
+        # endpoint -> route path, e.g. "/api/prospect_files/{request_id}/progress"
+        self.paths: Dict[Callable, str] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_PROGRESS.inc(labels=(method,))
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_REQUESTS_IN_PROGRESS.dec(labels=(method,))
+            route = self.route_path(scope)
+            HTTP_REQUESTS.inc(labels=(method, route, str(status_code)))
+            HTTP_REQUEST_DURATION.observe(elapsed, labels=(method, route))
+
+    def route_path(self, scope) -> str:
+        """The path template of the matched route, so that ids do not create labels"""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self.paths.get(endpoint)
+        if path is None:
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is not None:
+                    self.paths[route.endpoint] = route.path
+            path = self.paths.get(endpoint, "unmatched")
+        return path
+
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total",
+    "Number of HTTP requests",
+    ("method", "route", "status"),
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Latency of HTTP requests",
+    ("method", "route"),
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Number of HTTP requests being served",
+    ("method",),
+)
@@ -0,0 +1,31 @@
+import base64
+import json
+from typing import Any, List, Optional
+
+from .constants import MAX_PAGE_SIZE
+from .exceptions import InvalidCursorException
+
+
+def encode_cursor(last_id: int) -> str:
+    """Return the opaque token pointing after the row with the given id"""
+    payload = json.dumps({"id": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Return the id encoded in a token made by encode_cursor"""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        last_id = json.loads(payload)["id"]
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursorException
+    if not isinstance(last_id, int):
+        raise InvalidCursorException
+    return last_id
+
+
+def next_cursor(rows: List[Any], page_size: int) -> Optional[str]:
+    """Return the cursor of the page following rows, None on the last page"""
+    if not rows or len(rows) < min(page_size, MAX_PAGE_SIZE):
+        return None
+    return encode_cursor(rows[-1].id)
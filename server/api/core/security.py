@@ -1,18 +1,45 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Any, Union, Optional
+from weakref import WeakKeyDictionary
 from jose import jwt
 from passlib.context import CryptContext
-from sqlalchemy.orm.session import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .config import settings
+from .exceptions import ServiceUnavailableException
 from api import schemas
 from api.models import User
-from api.crud.user import UserCrud
+from api.crud import user as user_crud
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 ALGORITHM = "HS256"
 
+# bcrypt is slow on purpose, it runs on its own bounded pool so that it never
+# blocks the event loop nor takes the threads serving other requests
+password_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password"
+)
+
+# hashes running or waiting for a thread of the pool, by event loop: a
+# semaphore must be created and used on the same loop
+_password_slots: "WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    WeakKeyDictionary()
+)
+
+
+def password_slots() -> asyncio.Semaphore:
+    """The password slots of the running event loop, created on first use"""
+    loop = asyncio.get_running_loop()
+    slots = _password_slots.get(loop)
+    if slots is None:
+        slots = _password_slots[loop] = asyncio.Semaphore(
+            settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_SIZE
+        )
+    return slots
+
 
 def create_access_token(data: dict) -> str:
     """Create a JWT (access token) based on the provided data"""
@@ -30,6 +57,26 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def run_password_task(fn, *args):
+    """Run a password hashing function on the password pool, 503 if the pool is full"""
+    slots = password_slots()
+    if slots.locked():
+        raise ServiceUnavailableException
+    async with slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(password_executor, fn, *args)
+
+
+async def verify_password_async(plain_password: str, password_digest: str) -> bool:
+    """Same as verify_password, without blocking the event loop"""
+    return await run_password_task(verify_password, plain_password, password_digest)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Same as get_password_hash, without blocking the event loop"""
+    return await run_password_task(get_password_hash, password)
+
+
 def decode_token(token: str) -> schemas.Token:
     """Return a dictionary that represents the decoded JWT."""
     decoded = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
@@ -37,16 +84,16 @@ def decode_token(token: str) -> schemas.Token:
 
 
 async def authenticate_user(
-    db: Session, email: str, password: str
+    db: AsyncSession, email: str, password: str
 ) -> Union[bool, User]:
     """Based on the provided email & password, verify that the credentials match
     the records contained in the database.
     """
-    user = UserCrud.get_user_by_email(db, email)
+    user = await user_crud.UserCrud.get_user_by_email_async(db, email)
     if not user:
         # No user with that email exists in the database
         return False
-    if not verify_password(password, user.password_digest):
+    if not await verify_password_async(password, user.password_digest):
         # The user exists but the password was incorrect
         return False
     return user
@@ -1,12 +1,25 @@
-from typing import List, Set, Union
+from typing import List, Optional, Set, Union
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.session import Session
+from sqlalchemy.sql.expression import Select, any_, bindparam, literal, select
 from sqlalchemy.sql.functions import func
+from sqlalchemy.sql.sqltypes import BigInteger
 from api import schemas
-from api.models import Campaign, CampaignProspect
+from api.models import Campaign, CampaignProspect, Prospect
 from api.core.constants import DEFAULT_PAGE_SIZE, DEFAULT_PAGE, MIN_PAGE, MAX_PAGE_SIZE
 
 MAX_SEARCH_RESULTS = 10
 
+# number of prospects of a campaign, correlated to the campaigns of a query so
+# that a page and its counts are read with a single query
+PROSPECTS_COUNT = (
+    select(func.count(CampaignProspect.id))
+    .where(CampaignProspect.campaign_id == Campaign.id)
+    .scalar_subquery()
+    .label("prospects_count")
+)
+
 
 class CampaignCrud:
     @classmethod
@@ -16,38 +29,92 @@ class CampaignCrud:
         user_id: int,
         page: int = DEFAULT_PAGE,
         page_size: int = DEFAULT_PAGE_SIZE,
+        after_id: Optional[int] = None,
+    ) -> Union[List[schemas.Campaign], None]:
+        """
+        Get user's campaigns ordered by id.
+        If after_id is given, get the page following that campaign (keyset
+        pagination) instead of the page with the given number.
+        """
+        stmt = cls.users_campaign_statement(user_id, page, page_size, after_id)
+        return cls.with_prospects_count(db.execute(stmt).all())
+
+    @classmethod
+    async def get_users_campaign_async(
+        cls,
+        db: AsyncSession,
+        user_id: int,
+        page: int = DEFAULT_PAGE,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        after_id: Optional[int] = None,
     ) -> Union[List[schemas.Campaign], None]:
-        """Get user's campaigns"""
+        """Get user's campaigns ordered by id, see get_users_campaign"""
+        stmt = cls.users_campaign_statement(user_id, page, page_size, after_id)
+        return cls.with_prospects_count((await db.execute(stmt)).all())
+
+    @classmethod
+    def users_campaign_statement(
+        cls, user_id: int, page: int, page_size: int, after_id: Optional[int]
+    ) -> Select:
+        """Build the query of a page of user's campaigns"""
         if page < MIN_PAGE:
             page = MIN_PAGE
         if page_size > MAX_PAGE_SIZE:
             page_size = MAX_PAGE_SIZE
-        res = (
-            db.query(Campaign)
-            .filter(
-                Campaign.user_id == user_id,
-            )
-            .offset(page * page_size)
-            .limit(page_size)
-            .all()
+        stmt = select(Campaign, PROSPECTS_COUNT).where(
+            Campaign.user_id == user_id,
         )
-        return res
+        if after_id is not None:
+            stmt = stmt.where(Campaign.id > after_id).order_by(Campaign.id)
+        else:
+            stmt = stmt.order_by(Campaign.id).offset(page * page_size)
+        return stmt.limit(page_size)
+
+    @classmethod
+    def with_prospects_count(cls, rows: list) -> List[Campaign]:
+        """Set prospects_count on the campaigns of (Campaign, prospects_count) rows"""
+        campaigns = []
+        for campaign, prospects_count in rows:
+            campaign.prospects_count = prospects_count
+            campaigns.append(campaign)
+        return campaigns
 
     @classmethod
     def get_user_campaign_total(cls, db: Session, user_id: int) -> int:
         return db.query(Campaign).filter(Campaign.user_id == user_id).count()
 
+    @classmethod
+    async def get_user_campaign_total_async(cls, db: AsyncSession, user_id: int) -> int:
+        res = await db.execute(
+            select(func.count())
+            .select_from(Campaign)
+            .where(Campaign.user_id == user_id)
+        )
+        return res.scalar_one()
+
     @classmethod
     def get_user_campaign_from_name_fragment(
         cls, db: Session, user_id: int, name_fragment: str
     ) -> Union[List[Campaign], None]:
+        stmt = cls.name_fragment_statement(user_id, name_fragment)
+        return cls.with_prospects_count(db.execute(stmt).all())
+
+    @classmethod
+    async def get_user_campaign_from_name_fragment_async(
+        cls, db: AsyncSession, user_id: int, name_fragment: str
+    ) -> Union[List[Campaign], None]:
+        stmt = cls.name_fragment_statement(user_id, name_fragment)
+        return cls.with_prospects_count((await db.execute(stmt)).all())
+
+    @classmethod
+    def name_fragment_statement(cls, user_id: int, name_fragment: str) -> Select:
+        """Build the query of user's campaigns whose name contains name_fragment"""
         return (
-            db.query(Campaign)
-            .filter(
+            select(Campaign, PROSPECTS_COUNT)
+            .where(
                 Campaign.user_id == user_id, Campaign.name.ilike(f"%{name_fragment}%")
             )
             .limit(MAX_SEARCH_RESULTS)
-            .all()
         )
 
     @classmethod
@@ -61,27 +128,48 @@ class CampaignCrud:
         db.refresh(campaign)
         return campaign
 
-    @classmethod
-    def get_existing_campaign_prospects(cls, db: Session, campaign_id: int) -> Set[int]:
-        res = (
-            db.query(CampaignProspect.prospect_id)
-            .filter(CampaignProspect.campaign_id == campaign_id)
-            .all()
-        )
-        return {row.prospect_id for row in res}
-
     @classmethod
     def add_prospects_to_campaign(
-        cls, db: Session, campaign_id: int, prospect_ids: Set[int]
-    ):
-        links = [
-            CampaignProspect(campaign_id=campaign_id, prospect_id=prospect_id)
-            for prospect_id in prospect_ids
-        ]
-        db.add_all(links)
+        cls, db: Session, user_id: int, campaign_id: int, prospect_ids: Set[int]
+    ) -> List[int]:
+        """
+        Link prospects owned by the user to a campaign in a single statement.
+        Unknown ids, ids of other users' prospects and prospects already in the
+        campaign are skipped. Returns the ids of the newly added prospects.
+        """
+        if not prospect_ids:
+            return []
+
+        requested = bindparam(
+            "prospect_ids", list(prospect_ids), type_=postgresql.ARRAY(BigInteger)
+        )
+        prospects = select(literal(campaign_id, BigInteger), Prospect.id).where(
+            Prospect.user_id == user_id, Prospect.id == any_(requested)
+        )
+        stmt = (
+            postgresql.insert(CampaignProspect)
+            .from_select(["campaign_id", "prospect_id"], prospects)
+            .on_conflict_do_nothing(
+                index_elements=[
+                    CampaignProspect.campaign_id,
+                    CampaignProspect.prospect_id,
+                ]
+            )
+            .returning(CampaignProspect.prospect_id)
+        )
+        added = db.execute(stmt).scalars().all()
         db.commit()
+        return added
 
     @classmethod
     def get_by_id(cls, db: Session, campaign_id: int) -> Union[Campaign, None]:
         """Get a single user by id"""
         return db.query(Campaign).filter(Campaign.id == campaign_id).one_or_none()
+
+    @classmethod
+    async def get_by_id_async(
+        cls, db: AsyncSession, campaign_id: int
+    ) -> Union[Campaign, None]:
+        """Get a single campaign by id"""
+        res = await db.execute(select(Campaign).where(Campaign.id == campaign_id))
+        return res.scalars().one_or_none()
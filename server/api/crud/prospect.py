@@ -1,8 +1,13 @@
-from typing import List, Set, Union
+from typing import AsyncIterator, List, Optional, Tuple, Union
 from pydantic import EmailStr
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.engine import Row
 from sqlalchemy.orm.session import Session
+from sqlalchemy.sql.expression import Select, literal_column, select
+from sqlalchemy.sql.functions import func
 from api import schemas
-from api.models import Prospect
+from api.models import CampaignProspect, Prospect
 from api.core.constants import DEFAULT_PAGE_SIZE, DEFAULT_PAGE, MIN_PAGE, MAX_PAGE_SIZE
 
 
@@ -14,24 +19,93 @@ class ProspectCrud:
         user_id: int,
         page: int = DEFAULT_PAGE,
         page_size: int = DEFAULT_PAGE_SIZE,
+        after_id: Optional[int] = None,
     ) -> Union[List[Prospect], None]:
-        """Get user's prospects"""
+        """
+        Get user's prospects ordered by id.
+        If after_id is given, get the page following that prospect (keyset
+        pagination) instead of the page with the given number.
+        """
+        stmt = cls.users_prospects_statement(user_id, page, page_size, after_id)
+        return db.execute(stmt).scalars().all()
+
+    @classmethod
+    async def get_users_prospects_async(
+        cls,
+        db: AsyncSession,
+        user_id: int,
+        page: int = DEFAULT_PAGE,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        after_id: Optional[int] = None,
+    ) -> Union[List[Prospect], None]:
+        """Get user's prospects ordered by id, see get_users_prospects"""
+        stmt = cls.users_prospects_statement(user_id, page, page_size, after_id)
+        return (await db.execute(stmt)).scalars().all()
+
+    @classmethod
+    def users_prospects_statement(
+        cls, user_id: int, page: int, page_size: int, after_id: Optional[int]
+    ) -> Select:
+        """Build the query of a page of user's prospects"""
         if page < MIN_PAGE:
             page = MIN_PAGE
         if page_size > MAX_PAGE_SIZE:
             page_size = MAX_PAGE_SIZE
-        return (
-            db.query(Prospect)
-            .filter(Prospect.user_id == user_id)
-            .offset(page * page_size)
-            .limit(page_size)
-            .all()
-        )
+        stmt = select(Prospect).where(Prospect.user_id == user_id)
+        if after_id is not None:
+            stmt = stmt.where(Prospect.id > after_id).order_by(Prospect.id)
+        else:
+            stmt = stmt.order_by(Prospect.id).offset(page * page_size)
+        return stmt.limit(page_size)
+
+    @classmethod
+    async def stream_users_prospects_async(
+        cls,
+        db: AsyncSession,
+        user_id: int,
+        campaign_id: Optional[int],
+        batch_size: int,
+    ) -> AsyncIterator[List[Row]]:
+        """
+        Read all of user's prospects ordered by id, or only the ones in a
+        campaign, through a server side cursor in batches of batch_size rows
+        """
+        stmt = select(
+            Prospect.id,
+            Prospect.email,
+            Prospect.first_name,
+            Prospect.last_name,
+            Prospect.created_at,
+            Prospect.updated_at,
+        ).where(Prospect.user_id == user_id)
+        # both orders follow an index, the first rows come without sorting
+        if campaign_id is not None:
+            stmt = stmt.join(
+                CampaignProspect, CampaignProspect.prospect_id == Prospect.id
+            ).where(CampaignProspect.campaign_id == campaign_id)
+            stmt = stmt.order_by(CampaignProspect.prospect_id)
+        else:
+            stmt = stmt.order_by(Prospect.id)
+
+        result = await db.stream(stmt.execution_options(yield_per=batch_size))
+        async for rows in result.partitions(batch_size):
+            yield rows
 
     @classmethod
     def get_user_prospects_total(cls, db: Session, user_id: int) -> int:
         return db.query(Prospect).filter(Prospect.user_id == user_id).count()
 
+    @classmethod
+    async def get_user_prospects_total_async(
+        cls, db: AsyncSession, user_id: int
+    ) -> int:
+        res = await db.execute(
+            select(func.count())
+            .select_from(Prospect)
+            .where(Prospect.user_id == user_id)
+        )
+        return res.scalar_one()
+
     @classmethod
     def create_prospect(
         cls, db: Session, user_id: int, data: schemas.ProspectCreate
@@ -43,19 +117,6 @@ class ProspectCrud:
         db.refresh(prospect)
         return prospect
 
-    @classmethod
-    def validate_prospect_ids(
-        cls, db: Session, user_id: int, unvalidated_prospect_ids: Set[int]
-    ) -> Set[int]:
-        res = (
-            db.query(Prospect.id)
-            .filter(
-                Prospect.user_id == user_id, Prospect.id.in_(unvalidated_prospect_ids)
-            )
-            .all()
-        )
-        return {row.id for row in res}
-
     @classmethod
     def update_prospect(
         cls, db: Session, user_id: int, data: schemas.ProspectCreate
@@ -76,3 +137,70 @@ class ProspectCrud:
         return (
             db.query(Prospect).filter_by(email=email).filter_by(user_id=user_id).first()
         )
+
+    @classmethod
+    def upsert_prospects(
+        cls,
+        db: Session,
+        user_id: int,
+        rows: List[dict],
+        force: bool,
+        commit: bool = True,
+    ) -> Tuple[int, int]:
+        """
+        Insert a batch of prospects owned by current user in a single statement.
+        Existing prospects (same email) are updated if force is set, skipped otherwise.
+        Rows must have distinct emails. Returns the (inserted, updated) counts.
+        Without commit the statement is left in the transaction of the caller.
+        """
+        if not rows:
+            return 0, 0
+
+        # rows locked in email order: two transactions upserting overlapping
+        # emails of a user (concurrent imports, bulk requests) cannot deadlock
+        values = sorted(
+            ({**row, "user_id": user_id} for row in rows), key=lambda row: row["email"]
+        )
+        dialect = db.bind.dialect.name
+
+        if dialect == "postgresql":
+            stmt = postgresql.insert(Prospect).values(values)
+        else:
+            stmt = sqlite.insert(Prospect).values(values)
+            # no RETURNING available, count the rows that already exist instead
+            existing = (
+                db.query(func.count(Prospect.id))
+                .filter(
+                    Prospect.user_id == user_id,
+                    Prospect.email.in_([row["email"] for row in rows]),
+                )
+                .scalar()
+            )
+
+        if force:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Prospect.user_id, Prospect.email],
+                set_={
+                    "first_name": stmt.excluded.first_name,
+                    "last_name": stmt.excluded.last_name,
+                    "updated_at": func.now(),
+                },
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(
+                index_elements=[Prospect.user_id, Prospect.email]
+            )
+
+        if dialect == "postgresql":
+            # xmax is 0 for freshly inserted rows and set for updated ones
+            res = db.execute(stmt.returning(literal_column("xmax = 0"))).all()
+            inserted = sum(1 for row in res if row[0])
+            updated = len(res) - inserted
+        else:
+            db.execute(stmt)
+            inserted = len(rows) - existing
+            updated = existing if force else 0
+
+        if commit:
+            db.commit()
+        return inserted, updated
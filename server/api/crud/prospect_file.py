@@ -1,12 +1,20 @@
-import hashlib
+import os
 import uuid
+from datetime import datetime, timezone
+from typing import List, Union
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.session import Session
+from sqlalchemy.sql.expression import select
+from sqlalchemy.sql.functions import func
 
 from api.models import ProspectFile, prospect_file
 from api.core.config import settings
 from api.core.logger import log
 from api import schemas
 
+# key of the advisory lock serializing the claims of the import workers
+CLAIM_LOCK_ID = 7402
+
 
 class ProspectFileCrud:
     @classmethod
@@ -15,24 +23,31 @@ class ProspectFileCrud:
         db: Session,
         user_id: int,
         meta_data: schemas.ProspectFileCreate,
-        contents: bytes,
+        upload_path: str,
+        file_extension: str = ".csv",
     ) -> ProspectFile:
-        """Save uploaded file to disk and its meta data to database"""
+        """
+        Move the uploaded temp file into the file store and save its meta data
+        to database. The temp file is removed if an identical file is already stored.
+        Compressed files are stored as they are, with the extension of their format.
+        """
 
         # check if the same exact file exists in disk (using sha512 digest)
         existing_file = (
             db.query(ProspectFile)
-            .filter_by(sha512_digest=hashlib.sha512(contents).hexdigest())
+            .filter_by(sha512_digest=meta_data["sha512_digest"])
             .first()
         )
 
-        # if file does not exist, generate file_path and save it to disk
+        # if file does not exist, generate file_path and move it into the store
         if existing_file is None:
-            # generate unique filename and save file to disk
-            file_path = f"{settings.CSV_FILES_PATH}/{uuid.uuid4().hex}.csv"
-            with open(file_path, "wb+", buffering=settings.BUFFER_SIZE) as csv_file:
-                csv_file.write(contents)
+            # generate unique filename and atomically rename the temp file
+            file_path = f"{settings.CSV_FILES_PATH}/{uuid.uuid4().hex}{file_extension}"
+            os.replace(upload_path, file_path)
         else:
+            # the stored copy is reused, so the temp file is not needed anymore
+            os.remove(upload_path)
+
             # if file already exists, check if the incoming index parameters are different
             existing_email_index = existing_file.email_index
             existing_first_name_index = existing_file.first_name_index
@@ -78,6 +93,27 @@ class ProspectFileCrud:
         db.commit()
         return prospect_file
 
+    @classmethod
+    def update_claimed_prospect_file(
+        cls, db: Session, file_id: int, worker_id: str, data: dict
+    ) -> bool:
+        """
+        Update the ProspectFile with given id if the worker still holds its
+        claim, and commit it along with the rest of the transaction. If another
+        worker took the file over the whole transaction is rolled back, so
+        that nothing overwrites the state of the new owner. Returns False then.
+        """
+        updated = (
+            db.query(ProspectFile)
+            .filter(ProspectFile.id == file_id, ProspectFile.claimed_by == worker_id)
+            .update(data, synchronize_session=False)
+        )
+        if not updated:
+            db.rollback()
+            return False
+        db.commit()
+        return True
+
     @classmethod
     def get_prospect_file_by_id(
         cls, db: Session, user_id: int, file_id: int
@@ -101,3 +137,177 @@ class ProspectFileCrud:
             .filter_by(user_id=user_id)
             .first()
         )
+
+    @classmethod
+    async def get_prospect_file_by_request_id_async(
+        cls, db: AsyncSession, request_id: str, user_id: int
+    ) -> ProspectFile:
+        """Get the ProspectFile with given request id and owned by the current user"""
+        res = await db.execute(
+            select(ProspectFile)
+            .filter_by(request_id=request_id)
+            .filter_by(user_id=user_id)
+            .limit(1)
+        )
+        return res.scalars().first()
+
+    @classmethod
+    async def get_progress_by_ids_async(
+        cls, db: AsyncSession, file_ids: List[int]
+    ) -> List[tuple]:
+        """Get the id and the progress columns of the ProspectFiles with given ids"""
+        res = await db.execute(
+            select(
+                ProspectFile.id,
+                ProspectFile.status,
+                ProspectFile.rows_total,
+                ProspectFile.rows_done,
+                ProspectFile.started_at,
+                ProspectFile.rows_rejected,
+                ProspectFile.rows_inserted,
+                ProspectFile.rows_updated,
+            ).filter(ProspectFile.id.in_(file_ids))
+        )
+        return res.all()
+
+    @classmethod
+    def claim_next_prospect_file(
+        cls, db: Session, worker_id: str, max_running_per_user: int
+    ) -> Union[ProspectFile, None]:
+        """
+        Claim the next scheduled ProspectFile for the given worker and mark it
+        in_progress. Rows locked by other workers are skipped.
+
+        Users take turns: the next file is one of the user with the fewest
+        running files, below max_running_per_user, then of the user served the
+        longest ago. The smallest file of that user goes first.
+        """
+        # claims are serialized so that the running files counted are accurate
+        if db.bind.dialect.name == "postgresql":
+            db.execute(select(func.pg_advisory_xact_lock(CLAIM_LOCK_ID)))
+
+        users = (
+            db.query(
+                ProspectFile.user_id.label("user_id"),
+                func.count()
+                .filter(ProspectFile.status == schemas.ProspectFileStatus.in_progress)
+                .label("running"),
+                # the last heartbeat of a user's files is the time it was last served
+                func.max(ProspectFile.heartbeat_at).label("served_at"),
+            )
+            .filter(
+                ProspectFile.user_id.in_(
+                    db.query(ProspectFile.user_id).filter(
+                        ProspectFile.status == schemas.ProspectFileStatus.scheduled
+                    )
+                )
+            )
+            .group_by(ProspectFile.user_id)
+            .subquery()
+        )
+
+        prospect_file = (
+            db.query(ProspectFile)
+            .join(users, users.c.user_id == ProspectFile.user_id)
+            .filter(
+                ProspectFile.status == schemas.ProspectFileStatus.scheduled,
+                users.c.running < max_running_per_user,
+            )
+            .order_by(
+                users.c.running,
+                users.c.served_at.asc().nullsfirst(),
+                ProspectFile.file_size,
+                ProspectFile.id,
+            )
+            .with_for_update(of=ProspectFile, skip_locked=True)
+            .first()
+        )
+        if prospect_file is None:
+            db.rollback()
+            return None
+
+        prospect_file.status = schemas.ProspectFileStatus.in_progress
+        prospect_file.claimed_by = worker_id
+        prospect_file.heartbeat_at = datetime.now(timezone.utc)
+        prospect_file.attempts = prospect_file.attempts + 1
+        db.commit()
+        db.refresh(prospect_file)
+        return prospect_file
+
+    @classmethod
+    def count_scheduled_prospect_files(cls, db: Session, user_id: int) -> int:
+        """Count the ProspectFiles of current user waiting in the queue"""
+        return (
+            db.query(func.count(ProspectFile.id))
+            .filter(
+                ProspectFile.user_id == user_id,
+                ProspectFile.status == schemas.ProspectFileStatus.scheduled,
+            )
+            .scalar()
+        )
+
+    @classmethod
+    def get_queue_depths(cls, db: Session) -> List[tuple]:
+        """Count the scheduled and in_progress ProspectFiles, by user and status"""
+        return (
+            db.query(ProspectFile.user_id, ProspectFile.status, func.count())
+            .filter(
+                ProspectFile.status.in_(
+                    [
+                        schemas.ProspectFileStatus.scheduled,
+                        schemas.ProspectFileStatus.in_progress,
+                    ]
+                )
+            )
+            .group_by(ProspectFile.user_id, ProspectFile.status)
+            .order_by(ProspectFile.user_id)
+            .all()
+        )
+
+    @classmethod
+    def touch_prospect_file(cls, db: Session, file_id: int, worker_id: str) -> bool:
+        """Record a heartbeat for a ProspectFile, False if the worker lost its claim"""
+        updated = (
+            db.query(ProspectFile)
+            .filter(
+                ProspectFile.id == file_id,
+                ProspectFile.claimed_by == worker_id,
+                ProspectFile.status == schemas.ProspectFileStatus.in_progress,
+            )
+            .update(
+                {"heartbeat_at": datetime.now(timezone.utc)},
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        return updated > 0
+
+    @classmethod
+    def requeue_stale_prospect_files(
+        cls, db: Session, stale_before: datetime, max_attempts: int
+    ) -> int:
+        """
+        Put back in the queue the in_progress ProspectFiles whose worker stopped
+        sending heartbeats. Files which already used max_attempts are marked failed.
+        Returns the number of requeued files.
+        """
+        stale = (
+            ProspectFile.status == schemas.ProspectFileStatus.in_progress,
+            ProspectFile.heartbeat_at < stale_before,
+        )
+        db.query(ProspectFile).filter(
+            *stale, ProspectFile.attempts >= max_attempts
+        ).update(
+            {"status": schemas.ProspectFileStatus.failed, "claimed_by": None},
+            synchronize_session=False,
+        )
+        requeued = (
+            db.query(ProspectFile)
+            .filter(*stale)
+            .update(
+                {"status": schemas.ProspectFileStatus.scheduled, "claimed_by": None},
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        return requeued
@@ -1,9 +1,12 @@
-from typing import Union
+from typing import Optional, Union
 from fastapi.param_functions import Depends
 from pydantic.networks import EmailStr
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.session import Session
+from sqlalchemy.sql.expression import select
 from api import schemas
 from api.core import security
+from api.core.auth_cache import auth_cache
 from api.dependencies.db import get_db
 from api.models import User
 
@@ -15,13 +18,30 @@ class UserCrud:
         return db.query(User).filter(User.email == email.lower()).one_or_none()
 
     @classmethod
-    def create_user(cls, db: Session, data: schemas.UserCreate) -> User:
-        """Create a user"""
+    async def get_user_by_email_async(
+        cls, db: AsyncSession, email: EmailStr
+    ) -> Union[User, None]:
+        """Get a single user by email"""
+        res = await db.execute(select(User).where(User.email == email.lower()))
+        return res.scalar_one_or_none()
+
+    @classmethod
+    def create_user(
+        cls,
+        db: Session,
+        data: schemas.UserCreate,
+        password_digest: Optional[str] = None,
+    ) -> User:
+        """Create a user. The password is hashed here unless its digest is given."""
+        if password_digest is None:
+            password_digest = security.get_password_hash(data.password)
         user = User(
             email=data.email.lower(),
-            password_digest=security.get_password_hash(data.password),
+            password_digest=password_digest,
         )
         db.add(user)
         db.commit()
         db.refresh(user)
+        # drop any cached user previously known under this email
+        auth_cache.invalidate_user(user.email)
         return user
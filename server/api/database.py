@@ -1,11 +1,69 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 from dotenv import dotenv_values
 
+from api.core.config import settings
+from api.core.db_pool import instrument_engine, instrumented
+
 config = dotenv_values(".env")
 
-engine = create_engine(config.get("DATABASE_URL"))
+
+def async_database_url(database_url: str) -> str:
+    """Return the given Postgres URL using the asyncpg driver"""
+    url = make_url(database_url)
+    return str(url.set(drivername="postgresql+asyncpg"))
+
+
+def pool_options(name: str, pool_size: int, max_overflow: int) -> dict:
+    """Options of the named connection pool of an engine"""
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_logging_name": name,
+    }
+
+
+# sync engine, used by scripts and the write endpoints
+engine = create_engine(
+    config.get("DATABASE_URL"),
+    poolclass=instrumented(QueuePool),
+    **pool_options("api", settings.DB_POOL_SIZE, settings.DB_MAX_OVERFLOW),
+)
+instrument_engine(engine, "api")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# async engine, used by the hot read endpoints
+async_engine = create_async_engine(
+    async_database_url(config.get("DATABASE_URL")),
+    poolclass=instrumented(AsyncAdaptedQueuePool),
+    **pool_options("api_async", settings.DB_POOL_SIZE, settings.DB_MAX_OVERFLOW),
+)
+instrument_engine(async_engine.sync_engine, "api_async")
+AsyncSessionLocal = sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+# import engine, used by the import workers so that long imports never hold
+# the connections of the api
+import_engine = create_engine(
+    config.get("DATABASE_URL"),
+    poolclass=instrumented(QueuePool),
+    **pool_options(
+        "import",
+        # a running job holds two connections, its own and its heartbeat's
+        max(settings.IMPORT_DB_POOL_SIZE, 2 * settings.IMPORT_WORKER_CONCURRENCY),
+        settings.IMPORT_DB_MAX_OVERFLOW,
+    ),
+)
+instrument_engine(import_engine, "import")
+ImportSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=import_engine)
+
 Base = declarative_base()
@@ -1,6 +1,7 @@
-from fastapi import Depends
+import secrets
+from fastapi import Depends, HTTPException, status
 from fastapi.security.utils import get_authorization_scheme_param
-from sqlalchemy.orm.session import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.requests import Request
 from pydantic.networks import EmailStr
 
@@ -8,9 +9,11 @@ from jose import JWTError, ExpiredSignatureError
 
 from api import schemas
 from api.core import security
+from api.core.config import settings
+from api.core.auth_cache import auth_cache
 from api.core.exceptions import CredentialsException
 from api.crud.user import UserCrud
-from api.dependencies.db import get_db
+from api.dependencies.db import get_async_db
 
 
 def get_token(request: Request):
@@ -19,10 +22,20 @@ def get_token(request: Request):
     return header_param
 
 
-def get_current_user(token: str = Depends(get_token), db: Session = Depends(get_db)):
-    """Decode the provided jwt and extract the user using the [sub] field."""
+async def get_current_user(
+    token: str = Depends(get_token), db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Decode the provided jwt and extract the user using the [sub] field.
+    Users are cached per token, so repeated calls skip the decoding and the query.
+    """
     if not token:
         return None
+
+    user = auth_cache.get(token)
+    if user is not None:
+        return user
+
     try:
         payload = security.decode_token(token)
         email = payload.sub
@@ -30,10 +43,26 @@ def get_current_user(token: str = Depends(get_token), db: Session = Depends(get_
             # Something wrong with the token
             raise CredentialsException
         # Get user from database
-        user = UserCrud.get_user_by_email(db, email)
+        user = await UserCrud.get_user_by_email_async(db, email)
         if user is None:
             raise CredentialsException
+        # cache a detached snapshot of the user
+        user = schemas.User.from_orm(user)
+        auth_cache.set(token, user.email, user, payload.exp)
         return user
     except (JWTError, ExpiredSignatureError):
         # Something wrong with the token
         raise CredentialsException
+
+
+def verify_internal_token(token: str = Depends(get_token)):
+    """
+    Guard the internal endpoints: they only answer requests bearing
+    INTERNAL_TOKEN, and do not exist while it is unset.
+    """
+    if not settings.INTERNAL_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not token or not secrets.compare_digest(
+        token.encode(), settings.INTERNAL_TOKEN.encode()
+    ):
+        raise CredentialsException
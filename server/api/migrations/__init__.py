@@ -0,0 +1,94 @@
+"""
+Versioned schema migrations.
+
+db_init.py creates the tables of a new database from the models, migrations
+bring an existing database to the same schema in place. Every migration is a
+module of this package, listed in MIGRATIONS in order, with:
+
+- VERSION: its number, recorded in schema_migrations once it is applied
+- TRANSACTIONAL: False if it must run outside a transaction
+  (CREATE INDEX CONCURRENTLY), True to apply it all or nothing
+- upgrade(connection): applies it
+
+Migrations are idempotent, so that a database created by db_init.py, or left
+halfway by an interrupted non-transactional migration, can be migrated again.
+"""
+
+from typing import List, Set
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.sql.expression import text
+
+from . import v0001_prospect_file_columns, v0002_hot_path_indexes
+
+MIGRATIONS = [
+    v0001_prospect_file_columns,
+    v0002_hot_path_indexes,
+]
+
+# key of the advisory lock serializing the processes running migrations
+MIGRATE_LOCK_ID = 7403
+
+
+def name_of(migration) -> str:
+    return migration.__name__.rsplit(".", 1)[-1]
+
+
+def create_migrations_table(connection: Connection) -> None:
+    connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR NOT NULL,
+                applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+            )
+            """))
+
+
+def applied_versions(connection: Connection) -> Set[int]:
+    return set(
+        connection.execute(text("SELECT version FROM schema_migrations")).scalars()
+    )
+
+
+def pending_migrations(engine: Engine) -> List:
+    """The migrations not applied yet to the database, in order"""
+    with engine.begin() as connection:
+        create_migrations_table(connection)
+        applied = applied_versions(connection)
+    return [m for m in MIGRATIONS if m.VERSION not in applied]
+
+
+def migrate(engine: Engine) -> List[str]:
+    """Apply the pending migrations in order. Returns the names of the applied ones."""
+    applied = []
+    with engine.connect().execution_options(
+        isolation_level="AUTOCOMMIT"
+    ) as lock_connection:
+        # a second process waits, then finds nothing left to apply
+        lock_connection.execute(
+            text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATE_LOCK_ID}
+        )
+        try:
+            for migration in pending_migrations(engine):
+                if migration.TRANSACTIONAL:
+                    with engine.begin() as connection:
+                        migration.upgrade(connection)
+                        record(connection, migration)
+                else:
+                    with engine.connect().execution_options(
+                        isolation_level="AUTOCOMMIT"
+                    ) as connection:
+                        migration.upgrade(connection)
+                        record(connection, migration)
+                applied.append(name_of(migration))
+        finally:
+            lock_connection.execute(
+                text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATE_LOCK_ID}
+            )
+    return applied
+
+
+def record(connection: Connection, migration) -> None:
+    connection.execute(
+        text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+        {"version": migration.VERSION, "name": name_of(migration)},
+    )
@@ -0,0 +1,250 @@
+"""
+Check that the hot queries of the api and the import workers are served by
+the indexes meant for them.
+
+Each query is EXPLAINed with sequential scans disabled, the planner still
+resorts to one when no index can serve the query, and its plan must use the
+indexes expected for it. The plans of empty or tiny tables pick indexes at
+random, so the tables are first filled with sample users, prospects, campaigns
+and files and ANALYZEd, in a transaction rolled back at the end: the database
+and its statistics are left as they were.
+"""
+
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.expression import Executable, select, text, update
+from sqlalchemy.sql.functions import func
+
+from api.crud.campaign import CampaignCrud
+from api.crud.prospect import ProspectCrud
+from api.models import CampaignProspect, Prospect, ProspectFile
+from api.schemas.prospect_file import ProspectFileStatus
+
+# ids of the sample rows, far above the ids of real rows
+SAMPLE_ID = 1_000_000_000_000
+USER_ID = SAMPLE_ID + 1
+CAMPAIGN_ID = SAMPLE_ID + 101
+PROSPECT_ID = SAMPLE_ID + 1001
+
+# 50 users with 400 prospects, 20 campaigns of 20 prospects and 40 files each
+SAMPLE_ROWS = [
+    f"""
+    INSERT INTO users (id, email, password_digest)
+    SELECT {SAMPLE_ID} + u, 'check' || u || '@example.invalid', 'check' || u
+    FROM generate_series(1, 50) u
+    """,
+    f"""
+    INSERT INTO prospects (id, email, first_name, last_name, user_id)
+    SELECT {SAMPLE_ID} + u * 1000 + p, 'check' || p || '@example.invalid', '', '',
+        {SAMPLE_ID} + u
+    FROM generate_series(1, 50) u, generate_series(1, 400) p
+    """,
+    f"""
+    INSERT INTO campaigns (id, name, user_id)
+    SELECT {SAMPLE_ID} + u * 100 + c, 'check' || c, {SAMPLE_ID} + u
+    FROM generate_series(1, 50) u, generate_series(1, 20) c
+    """,
+    f"""
+    INSERT INTO campaigns_prospects (campaign_id, prospect_id)
+    SELECT {SAMPLE_ID} + u * 100 + c, {SAMPLE_ID} + u * 1000 + (c - 1) * 20 + p
+    FROM generate_series(1, 50) u, generate_series(1, 20) c, generate_series(1, 20) p
+    """,
+    f"""
+    INSERT INTO prospect_files (file_name, file_size, sha512_digest, file_path,
+        email_index, rows_total, rows_done, user_id, status, request_id)
+    SELECT 'check.csv', 0, md5(u || '-' || f), '', 0, 0, 0, {SAMPLE_ID} + u,
+        CASE mod(f, 20) WHEN 0 THEN 'scheduled' WHEN 1 THEN 'in_progress'
+        ELSE 'done' END,
+        'check-' || u || '-' || f
+    FROM generate_series(1, 50) u, generate_series(1, 40) f
+    """,
+]
+
+SAMPLE_TABLES = [
+    "users",
+    "prospects",
+    "campaigns",
+    "campaigns_prospects",
+    "prospect_files",
+]
+
+
+def prospects_upsert() -> Executable:
+    stmt = postgresql.insert(Prospect).values(
+        email="check@example.com", first_name="", last_name="", user_id=USER_ID
+    )
+    return stmt.on_conflict_do_nothing(
+        index_elements=[Prospect.user_id, Prospect.email]
+    )
+
+
+def campaign_prospects_export() -> Executable:
+    return (
+        select(Prospect.id, Prospect.email)
+        .join(CampaignProspect, CampaignProspect.prospect_id == Prospect.id)
+        .where(Prospect.user_id == USER_ID, CampaignProspect.campaign_id == CAMPAIGN_ID)
+        .order_by(CampaignProspect.prospect_id)
+    )
+
+
+def claimable_users() -> Executable:
+    scheduled = select(ProspectFile.user_id).where(
+        ProspectFile.status == ProspectFileStatus.scheduled
+    )
+    return (
+        select(ProspectFile.user_id, func.max(ProspectFile.heartbeat_at))
+        .where(ProspectFile.user_id.in_(scheduled))
+        .group_by(ProspectFile.user_id)
+    )
+
+
+def stale_prospect_files() -> Executable:
+    return (
+        update(ProspectFile)
+        .where(
+            ProspectFile.status == ProspectFileStatus.in_progress,
+            ProspectFile.heartbeat_at < datetime.now(timezone.utc),
+        )
+        .values(status=ProspectFileStatus.scheduled, claimed_by=None)
+    )
+
+
+# an index name, or a tuple of indexes serving the query equally well
+ExpectedIndex = Union[str, Tuple[str, ...]]
+
+# name: (query, indexes its plan must use)
+HOT_QUERIES: Dict[str, Tuple[Callable[[], Executable], List[ExpectedIndex]]] = {
+    "prospects page": (
+        lambda: ProspectCrud.users_prospects_statement(USER_ID, 0, 50, None),
+        ["ix_prospects_user_id_id"],
+    ),
+    "prospects page after id": (
+        lambda: ProspectCrud.users_prospects_statement(
+            USER_ID, 0, 50, SAMPLE_ID + 1200
+        ),
+        ["ix_prospects_user_id_id"],
+    ),
+    "prospects total": (
+        lambda: select(func.count())
+        .select_from(Prospect)
+        .where(Prospect.user_id == USER_ID),
+        ["ix_prospects_user_id_id"],
+    ),
+    "prospect by email": (
+        lambda: select(Prospect).filter_by(email="check@example.com", user_id=USER_ID),
+        ["uq_prospects_user_id_email"],
+    ),
+    "prospects upsert": (prospects_upsert, ["uq_prospects_user_id_email"]),
+    "campaign prospects export": (
+        campaign_prospects_export,
+        ["uq_campaigns_prospects_campaign_id_prospect_id"],
+    ),
+    "campaigns page": (
+        lambda: CampaignCrud.users_campaign_statement(USER_ID, 0, 50, None),
+        ["ix_campaigns_user_id_id", "uq_campaigns_prospects_campaign_id_prospect_id"],
+    ),
+    "campaigns of a prospect": (
+        lambda: select(CampaignProspect.campaign_id).where(
+            CampaignProspect.prospect_id == PROSPECT_ID
+        ),
+        ["ix_campaigns_prospects_prospect_id"],
+    ),
+    "prospect file by digest": (
+        lambda: select(ProspectFile).filter_by(sha512_digest="0" * 128),
+        ["ix_prospect_files_sha512_digest"],
+    ),
+    "prospect file by request id": (
+        lambda: select(ProspectFile).filter_by(request_id="check", user_id=USER_ID),
+        ["prospect_files_request_id_key"],
+    ),
+    "scheduled files of a user": (
+        lambda: select(func.count(ProspectFile.id)).where(
+            ProspectFile.user_id == USER_ID,
+            ProspectFile.status == ProspectFileStatus.scheduled,
+        ),
+        [("ix_prospect_files_status_user_id", "ix_prospect_files_user_id_status")],
+    ),
+    "claimable users": (
+        claimable_users,
+        ["ix_prospect_files_status_user_id", "ix_prospect_files_user_id_status"],
+    ),
+    "stale prospect files": (
+        stale_prospect_files,
+        ["ix_prospect_files_status_user_id"],
+    ),
+}
+
+
+def seq_scans(plan: dict) -> Iterator[str]:
+    """The tables read by a sequential scan in an EXPLAIN (FORMAT JSON) plan"""
+    if plan["Node Type"] == "Seq Scan":
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from seq_scans(child)
+
+
+def used_indexes(plan: dict) -> Iterator[str]:
+    """The indexes scanned, or arbitrating an ON CONFLICT, in an EXPLAIN (FORMAT JSON) plan"""
+    if "Index Name" in plan:
+        yield plan["Index Name"]
+    yield from plan.get("Conflict Arbiter Indexes", [])
+    for child in plan.get("Plans", []):
+        yield from used_indexes(child)
+
+
+def missing_indexes(expected: List[ExpectedIndex], used: List[str]) -> Iterator[str]:
+    for index in expected:
+        alternatives = (index,) if isinstance(index, str) else index
+        if not set(alternatives) & set(used):
+            yield " or ".join(alternatives)
+
+
+def check(engine: Engine) -> List[Tuple[str, List[str]]]:
+    """
+    EXPLAIN the hot queries. Returns every query with its problems: the
+    tables it reads through a sequential scan, the expected indexes it does
+    not use, or the error planning it (an ON CONFLICT target without unique
+    index). None if it uses the expected indexes only.
+    """
+    results = []
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            for statement in SAMPLE_ROWS:
+                connection.execute(text(statement))
+            for table in SAMPLE_TABLES:
+                connection.execute(text(f"ANALYZE {table}"))
+            connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            for name, (build, expected) in HOT_QUERIES.items():
+                compiled = build().compile(
+                    dialect=connection.dialect,
+                    compile_kwargs={"render_postcompile": True},
+                )
+                savepoint = connection.begin_nested()
+                try:
+                    plan = connection.exec_driver_sql(
+                        f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+                    ).scalar()
+                except DBAPIError as e:
+                    savepoint.rollback()
+                    results.append((name, [str(e.orig).splitlines()[0]]))
+                    continue
+                savepoint.commit()
+                tables = sorted(set(seq_scans(plan[0]["Plan"])))
+                used = list(used_indexes(plan[0]["Plan"]))
+                results.append(
+                    (
+                        name,
+                        [f"sequential scan of {table}" for table in tables]
+                        + [
+                            f"does not use {index}"
+                            for index in missing_indexes(expected, used)
+                        ],
+                    )
+                )
+        finally:
+            transaction.rollback()
+    return results
@@ -0,0 +1,25 @@
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.expression import text
+
+
+def create_index_concurrently(
+    connection: Connection, name: str, on: str, unique: bool = False
+) -> None:
+    """
+    Build the index name on the "table (columns)" on, unless it exists. A
+    failed concurrent build leaves an invalid index behind, which is dropped
+    and built again.
+    """
+    valid = connection.execute(
+        text("""
+            SELECT i.indisvalid FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = :name
+            """),
+        {"name": name},
+    ).scalar()
+    if valid is False:
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    connection.execute(text(f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {name} ON {on}"))
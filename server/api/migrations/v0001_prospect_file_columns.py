@@ -0,0 +1,27 @@
+"""Add the import progress, job queue and checkpoint columns of prospect_files"""
+
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.expression import text
+
+VERSION = 1
+TRANSACTIONAL = True
+
+COLUMNS = [
+    "started_at TIMESTAMP WITH TIME ZONE",
+    "claimed_by VARCHAR",
+    "heartbeat_at TIMESTAMP WITH TIME ZONE",
+    "attempts INTEGER NOT NULL DEFAULT 0",
+    "checkpoint_offset BIGINT NOT NULL DEFAULT 0",
+    "checkpoint_rows INTEGER NOT NULL DEFAULT 0",
+    "rows_rejected INTEGER NOT NULL DEFAULT 0",
+    "rows_inserted INTEGER NOT NULL DEFAULT 0",
+    "rows_updated INTEGER NOT NULL DEFAULT 0",
+]
+
+
+def upgrade(connection: Connection) -> None:
+    # a constant default fills existing rows without rewriting the table
+    for column in COLUMNS:
+        connection.execute(
+            text(f"ALTER TABLE prospect_files ADD COLUMN IF NOT EXISTS {column}")
+        )
@@ -0,0 +1,93 @@
+"""
+Index the lookups of the hot paths and make prospects unique per user and
+email, and campaign links unique per campaign and prospect.
+
+The indexes are built concurrently so that a live database keeps serving
+reads and writes meanwhile. Duplicates are removed first, the unique indexes
+could not be built otherwise.
+"""
+
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.expression import text
+
+from .indexes import create_index_concurrently
+
+VERSION = 2
+TRANSACTIONAL = False
+
+# every prospect with the id of the prospect kept among its duplicates (the oldest)
+DUPLICATE_PROSPECTS = """
+    SELECT id, min(id) OVER (PARTITION BY user_id, email) AS kept_id
+    FROM prospects
+"""
+
+DEDUPLICATE = [
+    # links to a duplicate prospect now point to the kept one
+    f"""
+    UPDATE campaigns_prospects cp SET prospect_id = d.kept_id
+    FROM ({DUPLICATE_PROSPECTS}) d
+    WHERE cp.prospect_id = d.id AND d.id <> d.kept_id
+    """,
+    f"""
+    DELETE FROM prospects p
+    USING ({DUPLICATE_PROSPECTS}) d
+    WHERE p.id = d.id AND d.id <> d.kept_id
+    """,
+    # the oldest link of a prospect to a campaign is kept
+    """
+    DELETE FROM campaigns_prospects a
+    USING campaigns_prospects b
+    WHERE a.campaign_id = b.campaign_id
+    AND a.prospect_id = b.prospect_id
+    AND a.id > b.id
+    """,
+]
+
+# name: (table (columns), unique)
+INDEXES = {
+    # per prospect email lookup, target of the bulk upsert
+    "uq_prospects_user_id_email": ("prospects (user_id, email)", True),
+    # keyset pagination and counts of a user's prospects
+    "ix_prospects_user_id_id": ("prospects (user_id, id)", False),
+    # keyset pagination of a user's campaigns
+    "ix_campaigns_user_id_id": ("campaigns (user_id, id)", False),
+    # prospects of a campaign, target of ON CONFLICT DO NOTHING
+    "uq_campaigns_prospects_campaign_id_prospect_id": (
+        "campaigns_prospects (campaign_id, prospect_id)",
+        True,
+    ),
+    # campaigns of a prospect
+    "ix_campaigns_prospects_prospect_id": ("campaigns_prospects (prospect_id)", False),
+    # identical files already uploaded
+    "ix_prospect_files_sha512_digest": ("prospect_files (sha512_digest)", False),
+    # the import queue: scheduled and running files, and the files of a user
+    "ix_prospect_files_status_user_id": ("prospect_files (status, user_id)", False),
+    "ix_prospect_files_user_id_status": ("prospect_files (user_id, status)", False),
+}
+
+# unique indexes backing a constraint, as created by db_init.py
+CONSTRAINTS = {
+    "uq_prospects_user_id_email": "prospects",
+    "uq_campaigns_prospects_campaign_id_prospect_id": "campaigns_prospects",
+}
+
+
+def upgrade(connection: Connection) -> None:
+    for statement in DEDUPLICATE:
+        connection.execute(text(statement))
+
+    for name, (on, unique) in INDEXES.items():
+        create_index_concurrently(connection, name, on, unique)
+
+    for name, table in CONSTRAINTS.items():
+        exists = connection.execute(
+            text("SELECT 1 FROM pg_constraint WHERE conname = :name"),
+            {"name": name},
+        ).scalar()
+        if not exists:
+            # only takes a brief lock, the index is already built
+            connection.execute(
+                text(
+                    f"ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}"
+                )
+            )
@@ -1,6 +1,6 @@
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.functions import func
-from sqlalchemy.sql.schema import Column, ForeignKey
+from sqlalchemy.sql.schema import Column, ForeignKey, Index
 from sqlalchemy.sql.sqltypes import BigInteger, DateTime, Integer, String
 
 from api.database import Base
@@ -10,6 +10,10 @@ class Campaign(Base):
     """Campaigns Table"""
 
     __tablename__ = "campaigns"
+    __table_args__ = (
+        # keyset pagination of a user's campaigns
+        Index("ix_campaigns_user_id_id", "user_id", "id"),
+    )
 
     id = Column(BigInteger, primary_key=True, autoincrement=True, unique=True)
     name = Column(String, primary_key=True)
@@ -1,6 +1,6 @@
 from xmlrpc.client import Boolean
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql.schema import Column, ForeignKey
+from sqlalchemy.sql.schema import Column, ForeignKey, Index
 from sqlalchemy.sql.functions import func
 from sqlalchemy.sql.sqltypes import BigInteger, Integer, String, DateTime, Boolean
 from api.database import Base
@@ -10,11 +10,17 @@ class ProspectFile(Base):
     """Prospect Files Table"""
 
     __tablename__ = "prospect_files"
+    __table_args__ = (
+        # the queue: scheduled and running files, by user
+        Index("ix_prospect_files_status_user_id", "status", "user_id"),
+        # a user's files: their jobs waiting in the queue, their last heartbeat
+        Index("ix_prospect_files_user_id_status", "user_id", "status"),
+    )
 
     id = Column(BigInteger, primary_key=True, autoincrement=True, unique=True)
     file_name = Column(String, index=False, nullable=False, unique=False)
     file_size = Column(BigInteger, nullable=False)
-    sha512_digest = Column(String, index=False, unique=False, nullable=False)
+    sha512_digest = Column(String, index=True, unique=False, nullable=False)
     file_path = Column(String, nullable=False)
     email_index = Column(Integer, nullable=False)
     first_name_index = Column(Integer, nullable=True)
@@ -26,6 +32,7 @@ class ProspectFile(Base):
     uploaded_at = Column(
         DateTime(timezone=True), server_default=func.now(), nullable=False
     )
+    started_at = Column(DateTime(timezone=True), nullable=True)
     user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
 
     uploaded_by = relationship(
@@ -35,5 +42,18 @@ class ProspectFile(Base):
     status = Column(String, nullable=False)
     request_id = Column(String, nullable=False, unique=True)
 
+    # import job queue bookkeeping
+    claimed_by = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    attempts = Column(Integer, nullable=False, server_default="0")
+
+    # last checkpoint of the import: offset in the file after the last
+    # persisted batch, rows read up to it and counts of the rows so far
+    checkpoint_offset = Column(BigInteger, nullable=False, server_default="0")
+    checkpoint_rows = Column(Integer, nullable=False, server_default="0")
+    rows_rejected = Column(Integer, nullable=False, server_default="0")
+    rows_inserted = Column(Integer, nullable=False, server_default="0")
+    rows_updated = Column(Integer, nullable=False, server_default="0")
+
     def __repr__(self):
         return f"{self.id} | {self.sha512_digest}"
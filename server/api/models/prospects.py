@@ -1,6 +1,6 @@
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.functions import func
-from sqlalchemy.sql.schema import Column, ForeignKey
+from sqlalchemy.sql.schema import Column, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.sql.sqltypes import BigInteger, DateTime, String
 
 from api.database import Base
@@ -10,6 +10,12 @@ class Prospect(Base):
     """Prospects Table"""
 
     __tablename__ = "prospects"
+    __table_args__ = (
+        # target of the bulk upsert (INSERT ... ON CONFLICT (user_id, email))
+        UniqueConstraint("user_id", "email", name="uq_prospects_user_id_email"),
+        # keyset pagination of a user's prospects
+        Index("ix_prospects_user_id_id", "user_id", "id"),
+    )
 
     id = Column(BigInteger, primary_key=True, autoincrement=True, unique=True)
     email = Column(String, primary_key=True, nullable=False)
@@ -1,4 +1,6 @@
+from typing import Optional
 from fastapi import APIRouter, HTTPException, status, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.session import Session
 from starlette.responses import JSONResponse
 from starlette.status import HTTP_401_UNAUTHORIZED
@@ -6,41 +8,61 @@ from starlette.status import HTTP_401_UNAUTHORIZED
 from api import schemas
 from api.dependencies.auth import get_current_user
 from api.core.constants import DEFAULT_PAGE, DEFAULT_PAGE_SIZE
-from api.crud import CampaignCrud, ProspectCrud
-from api.dependencies.db import get_db
+from api.core.pagination import decode_cursor, next_cursor
+from api.crud import CampaignCrud
+from api.dependencies.db import get_async_db, get_db
 
 router = APIRouter(prefix="/api", tags=["campaigns"])
 
 
 @router.get("/campaigns", response_model=schemas.CampaignResponse)
-def get_campaign_page(
+async def get_campaign_page(
     current_user: schemas.User = Depends(get_current_user),
     page: int = DEFAULT_PAGE,
     page_size: int = DEFAULT_PAGE_SIZE,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    db: AsyncSession = Depends(get_async_db),
 ):
-    """Get a single page of campaigns"""
+    """
+    Get a single page of campaigns.
+    Pass the next_cursor of a page as cursor to get the following page, this
+    is faster than page numbers on deep pages. Counting the total can be
+    skipped with include_total=false.
+    """
     if not current_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Please log in"
         )
-    campaigns = CampaignCrud.get_users_campaign(db, current_user.id, page, page_size)
-    total = CampaignCrud.get_user_campaign_total(db, current_user.id)
-    return {"campaigns": campaigns, "size": len(campaigns), "total": total}
+    after_id = decode_cursor(cursor) if cursor else None
+    campaigns = await CampaignCrud.get_users_campaign_async(
+        db, current_user.id, page, page_size, after_id
+    )
+    total = (
+        await CampaignCrud.get_user_campaign_total_async(db, current_user.id)
+        if include_total
+        else None
+    )
+    return {
+        "campaigns": campaigns,
+        "size": len(campaigns),
+        "total": total,
+        "next_cursor": next_cursor(campaigns, page_size),
+    }
 
 
 @router.get("/campaigns/search", response_model=schemas.CampaignSearchResponse)
-def search_campaigns(
+async def search_campaigns(
     query: str,
     current_user: schemas.User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Search campaigns by name"""
     if not current_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Please log in"
         )
-    campaigns = CampaignCrud.get_user_campaign_from_name_fragment(
+    campaigns = await CampaignCrud.get_user_campaign_from_name_fragment_async(
         db, current_user.id, query
     )
     return {"campaigns": campaigns}
@@ -72,17 +94,9 @@ def add_prospects_to_campaign(
             detail=f"You do not have access to that campaign",
         )
 
-    # Get existing prospects for this campaign
-    existing_prospect_ids = CampaignCrud.get_existing_campaign_prospects(
-        db, campaign_id
+    # Add only the user's prospects which are not in the campaign yet
+    new_prospect_ids = CampaignCrud.add_prospects_to_campaign(
+        db, current_user.id, campaign.id, data.prospect_ids
     )
 
-    data.prospect_ids = ProspectCrud.validate_prospect_ids(
-        db, current_user.id, data.prospect_ids
-    )
-
-    # Add only valid/non-duplicate prospects
-    new_prospect_ids = data.prospect_ids - existing_prospect_ids
-    CampaignCrud.add_prospects_to_campaign(db, campaign_id, new_prospect_ids)
-
-    return JSONResponse({"prospect_ids": list(new_prospect_ids)}, 200)
+    return JSONResponse({"prospect_ids": new_prospect_ids}, 200)
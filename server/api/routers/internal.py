@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm.session import Session
+
+from api.core.db_pool import pool_report
+from api.crud import ProspectFileCrud
+from api.dependencies.auth import verify_internal_token
+from api.dependencies.db import get_db
+
+# operational endpoints, only served to requests bearing INTERNAL_TOKEN
+router = APIRouter(
+    prefix="/internal",
+    tags=["internal"],
+    dependencies=[Depends(verify_internal_token)],
+)
+
+
+@router.get("/pools")
+def get_pools():
+    """Get the state and usage of the database connection pools of this process"""
+    return pool_report()
+
+
+@router.get("/imports")
+def get_imports(db: Session = Depends(get_db)):
+    """
+    Get the number of scheduled and running imports, in total and by user.
+    The activity of every user is reported, hence the internal token guard of
+    the router.
+    """
+    users = {}
+    totals = {"scheduled": 0, "in_progress": 0}
+    for user_id, status, count in ProspectFileCrud.get_queue_depths(db):
+        users.setdefault(user_id, {"user_id": user_id, **dict.fromkeys(totals, 0)})
+        users[user_id][status] = count
+        totals[status] += count
+
+    return {**totals, "users": list(users.values())}
@@ -1,4 +1,3 @@
-import hashlib
 import uuid
 from datetime import datetime
 from typing import Optional, Union
@@ -9,16 +8,22 @@ from fastapi import (
     Depends,
     File,
     Form,
+    Header,
+    Request,
     UploadFile,
-    BackgroundTasks,
 )
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.session import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
 from api import schemas
 from api.dependencies.auth import get_current_user
-from api.dependencies.db import get_db
+from api.dependencies.db import get_async_db, get_db
 from api.core.config import settings
 from api.crud import ProspectFileCrud
-from api.services import tracker, worker
+from api.services import progress_hub, tracker, uploads
+from api.services.compression import EXTENSIONS, detect_compression, is_supported
+from api.services.file_store import FileTooLargeError, discard_upload, save_upload
 from api.core.logger import log
 
 router = APIRouter(prefix="/api", tags=["prospects_files"])
@@ -30,7 +35,6 @@ router = APIRouter(prefix="/api", tags=["prospects_files"])
     status_code=status.HTTP_202_ACCEPTED,
 )
 async def import_prospects(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     email_index: int = Form(...),
     first_name_index: Optional[int] = Form(None),
@@ -40,7 +44,7 @@ async def import_prospects(
     current_user: schemas.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    """Submit uploaded file to background process and send CREATED status code"""
+    """Queue uploaded file for the import workers and send ACCEPTED status code"""
 
     # request should include bearer token (clients needs to login first)
     if not current_user:
@@ -50,36 +54,94 @@ async def import_prospects(
             detail="Unauthorized request. Client needs to login first.",
         )
 
-    # accept only certain mime types: text/csv, text/plain, ...
-    if file.content_type not in settings.ALLOWED_MIME_TYPES:
+    # gzip and zstd compressed files are recognized by their first bytes
+    compression = detect_compression(await file.read(4))
+    await file.seek(0)
+    check_file_type(file.content_type, compression)
+    await check_import_queue(db, current_user.id)
+
+    # stream the uploaded file to disk, hashing it on the way
+    try:
+        upload = await save_upload(file)
+    except FileTooLargeError:
+        # Uploaded file size should not exceed max value
+        log.info("HTTP_413_REQUEST_ENTITY_TOO_LARGE")
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File too large (max allowed size = {settings.MAX_FILE_SIZE / (1024 * 1024)} MB).",
+        )
+
+    return await schedule_prospect_file(
+        db,
+        current_user.id,
+        {
+            "file_name": file.filename,
+            "email_index": email_index,
+            "first_name_index": first_name_index,
+            "last_name_index": last_name_index,
+            "force": force,
+            "has_headers": has_headers,
+        },
+        upload,
+        compression,
+    )
+
+
+def check_file_type(content_type: str, compression: Optional[str]) -> None:
+    """Accept only certain mime types: text/csv, text/plain, ... or compressed files"""
+    if compression is None and content_type not in settings.ALLOWED_MIME_TYPES:
         log.info("HTTP_415_UNSUPPORTED_MEDIA_TYPE")
         raise HTTPException(
             status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-            detail=f"File must be a plain text or csv file. {file.content_type}",
+            detail=f"File must be a plain text, csv, gzip or zstd file. {content_type}",
         )
 
-    # read the contents of uploaded file
-    contents = await file.read()
+    if not is_supported(compression):
+        log.info("HTTP_415_UNSUPPORTED_MEDIA_TYPE")
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"{compression} compressed files are not supported by this server.",
+        )
 
-    # Uploaded file size should not exceed max value
-    if len(contents) > settings.MAX_FILE_SIZE:
-        log.info("HTTP_413_REQUEST_ENTITY_TOO_LARGE")
+
+async def check_import_queue(db: Session, user_id: int) -> None:
+    """Refuse imports while the user has IMPORT_MAX_QUEUED_PER_USER files queued"""
+    queued = await run_in_threadpool(
+        ProspectFileCrud.count_scheduled_prospect_files, db, user_id
+    )
+    if queued >= settings.IMPORT_MAX_QUEUED_PER_USER:
+        log.info("HTTP_429_TOO_MANY_REQUESTS")
         raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail=f"File too large (max allowed size = {settings.MAX_FILE_SIZE / (1024 * 1024)} MB).",
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Too many imports queued (max allowed = {settings.IMPORT_MAX_QUEUED_PER_USER}).",
+            headers={"Retry-After": str(settings.IMPORT_RETRY_AFTER)},
         )
 
+
+async def schedule_prospect_file(
+    db: Session,
+    user_id: int,
+    params: dict,
+    upload: dict,
+    compression: Optional[str],
+) -> dict:
+    """Store an upload and queue it for the import workers"""
+
     # generate a unique request id for tracking progress
     unique_request_id = uuid.uuid4().hex
 
+    first_name_index = params["first_name_index"]
+    last_name_index = params["last_name_index"]
+
     # persist the uploaded file and its meta data
-    prospect_file = ProspectFileCrud.create_prospect_file(
+    prospect_file = await run_in_threadpool(
+        ProspectFileCrud.create_prospect_file,
         db,
-        current_user.id,
+        user_id,
         {
             # required fields
-            "file_name": file.filename,
-            "email_index": email_index,
+            "file_name": params["file_name"],
+            "email_index": params["email_index"],
             # optional fields with default values
             "first_name_index": (first_name_index, None)[
                 not first_name_index or first_name_index < 1
@@ -87,16 +149,17 @@ async def import_prospects(
             "last_name_index": (last_name_index, None)[
                 not last_name_index or last_name_index < 1
             ],
-            "has_headers": (has_headers, None)[not has_headers],
-            "force": (force, None)[not force],
+            "has_headers": (params["has_headers"], None)[not params["has_headers"]],
+            "force": (params["force"], None)[not params["force"]],
             # derived fields
-            "file_size": len(contents),
-            "sha512_digest": hashlib.sha512(contents).hexdigest(),
+            "file_size": upload["file_size"],
+            "sha512_digest": upload["sha512_digest"],
             "uploaded_at": datetime.now(),
             "status": schemas.ProspectFileStatus.scheduled,
             "request_id": unique_request_id,
         },
-        contents,
+        upload["upload_path"],
+        EXTENSIONS[compression],
     )
 
     # If None, file must have been processed earlier and cannot be
@@ -109,8 +172,7 @@ async def import_prospects(
             detail=f"The same exact file has already been processed previously.",
         )
 
-    # submit the file id for asynchronous processing
-    background_tasks.add_task(worker.execute, db, current_user.id, prospect_file.id)
+    # the file is now scheduled, an import worker (worker.py) will pick it up
 
     return {
         "request_id": unique_request_id,
@@ -118,17 +180,168 @@ async def import_prospects(
     }
 
 
+@router.post(
+    "/prospect_files/uploads",
+    response_model=schemas.UploadSessionResponse,
+    status_code=status.HTTP_201_CREATED,
+)
+def create_upload(
+    data: schemas.UploadSessionCreate,
+    current_user: schemas.User = Depends(get_current_user),
+):
+    """
+    Start a resumable upload. The file is then sent in chunks of chunk_size
+    bytes (PUT .../chunks/{index}), in any order and as many times as needed,
+    before completing the upload.
+    """
+    if not current_user:
+        log.info("HTTP_401_UNAUTHORIZED")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthorized request. Client needs to login first.",
+        )
+
+    if data.file_size > settings.MAX_FILE_SIZE:
+        log.info("HTTP_413_REQUEST_ENTITY_TOO_LARGE")
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File too large (max allowed size = {settings.MAX_FILE_SIZE / (1024 * 1024)} MB).",
+        )
+    if data.file_size < 1:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="The file is empty.",
+        )
+
+    session = uploads.create_session(current_user.id, data.dict())
+    return uploads.session_status(session)
+
+
+@router.put(
+    "/prospect_files/uploads/{upload_id}/chunks/{index}",
+    response_model=schemas.UploadSessionResponse,
+)
+async def upload_chunk(
+    upload_id: str,
+    index: int,
+    request: Request,
+    x_chunk_sha256: str = Header(...),
+    current_user: schemas.User = Depends(get_current_user),
+):
+    """Receive a chunk of a resumable upload, checked against its sha256 digest"""
+    session = load_upload_session(upload_id, current_user)
+    try:
+        await uploads.write_chunk(session, index, request.stream(), x_chunk_sha256)
+    except uploads.ChunkError as e:
+        log.info("HTTP_400_BAD_REQUEST")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except uploads.UploadCompletedError:
+        raise upload_completed()
+    return uploads.session_status(session)
+
+
+@router.get(
+    "/prospect_files/uploads/{upload_id}",
+    response_model=schemas.UploadSessionResponse,
+)
+def get_upload(
+    upload_id: str,
+    current_user: schemas.User = Depends(get_current_user),
+):
+    """Get the chunks received and missing of a resumable upload"""
+    return uploads.session_status(load_upload_session(upload_id, current_user))
+
+
+@router.post(
+    "/prospect_files/uploads/{upload_id}/complete",
+    response_model=schemas.ProspectFileCreatedResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def complete_upload(
+    upload_id: str,
+    current_user: schemas.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Queue the file of a complete resumable upload for the import workers"""
+    session = load_upload_session(upload_id, current_user)
+
+    # the session is not claimed yet, completing it can be retried
+    await check_import_queue(db, current_user.id)
+
+    try:
+        upload = await run_in_threadpool(uploads.assemble, session)
+    except uploads.UploadIncompleteError:
+        log.info("HTTP_409_CONFLICT")
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Missing chunks {uploads.session_status(session)['missing']}.",
+        )
+    except uploads.UploadCompletedError:
+        raise upload_completed()
+
+    try:
+        with open(upload["upload_path"], "rb") as uploaded:
+            compression = detect_compression(uploaded.read(4))
+        check_file_type(session["content_type"], compression)
+    except HTTPException:
+        discard_upload(upload["upload_path"])
+        raise
+
+    return await schedule_prospect_file(
+        db, current_user.id, session, upload, compression
+    )
+
+
+@router.delete(
+    "/prospect_files/uploads/{upload_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+)
+def cancel_upload(
+    upload_id: str,
+    current_user: schemas.User = Depends(get_current_user),
+):
+    """Abandon a resumable upload"""
+    uploads.discard_session(load_upload_session(upload_id, current_user))
+
+
+def load_upload_session(upload_id: str, current_user: schemas.User) -> dict:
+    if not current_user:
+        log.info("HTTP_401_UNAUTHORIZED")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthorized request. Client needs to login first.",
+        )
+    try:
+        return uploads.load_session(upload_id, current_user.id)
+    except uploads.UploadSessionNotFoundError:
+        log.info("HTTP_404_NOT_FOUND")
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found."
+        )
+    except uploads.UploadCompletedError:
+        raise upload_completed()
+
+
+def upload_completed() -> HTTPException:
+    log.info("HTTP_409_CONFLICT")
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT, detail="Upload already completed."
+    )
+
+
 @router.get(
     "/prospect_files/{request_id}/progress",
     response_model=Union[
-        schemas.ProspectFileStatusResponse, schemas.ProspectFileDoneResponse
+        schemas.ProspectFileProgressResponse,
+        schemas.ProspectFileDoneResponse,
+        schemas.ProspectFileStatusResponse,
     ],
     status_code=status.HTTP_200_OK,
 )
-def track_progress(
+async def track_progress(
     request_id: str,
     current_user: schemas.User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
 
     if not current_user:
@@ -138,7 +351,7 @@ def track_progress(
             detail="User must be authenticated",
         )
 
-    result = tracker.track_progress(request_id, current_user.id, db)
+    result = await tracker.track_progress_async(request_id, current_user.id, db)
 
     if result is None:
         log.info("HTTP_404_NOT_FOUND")
@@ -147,3 +360,48 @@ def track_progress(
         )
 
     return result
+
+
+@router.get(
+    "/prospect_files/{request_id}/events",
+    response_class=StreamingResponse,
+    status_code=status.HTTP_200_OK,
+)
+async def stream_progress(
+    request_id: str,
+    current_user: schemas.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Stream the progress of an import as Server-Sent Events: a "progress"
+    event whenever it changes, then a "done" (or "failed") event closing the
+    stream. The events hold the body of GET .../progress and the status.
+    """
+
+    if not current_user:
+        log.info("HTTP_401_UNAUTHORIZED")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User must be authenticated",
+        )
+
+    prospect_file = await ProspectFileCrud.get_prospect_file_by_request_id_async(
+        db, request_id, current_user.id
+    )
+
+    if prospect_file is None:
+        log.info("HTTP_404_NOT_FOUND")
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=f"Resource file not found."
+        )
+
+    state = progress_hub.state_of(prospect_file)
+
+    # the stream outlives the request, do not hold a connection meanwhile
+    await db.close()
+
+    return StreamingResponse(
+        tracker.progress_events(prospect_file.id, state),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
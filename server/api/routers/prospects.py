@@ -1,26 +1,145 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Request, status, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.session import Session
+from starlette.responses import StreamingResponse
 from api import schemas
 from api.dependencies.auth import get_current_user
 from api.core.constants import DEFAULT_PAGE, DEFAULT_PAGE_SIZE
-from api.crud import ProspectCrud
-from api.dependencies.db import get_db
+from api.core.pagination import decode_cursor, next_cursor
+from api.crud import CampaignCrud, ProspectCrud
+from api.core.config import settings
+from api.core.logger import log
+from api.dependencies.db import get_async_db, get_db
+from api.services import bulk_import, exporter
 
 router = APIRouter(prefix="/api", tags=["prospects"])
 
 
 @router.get("/prospects", response_model=schemas.ProspectResponse)
-def get_prospects_page(
+async def get_prospects_page(
     current_user: schemas.User = Depends(get_current_user),
     page: int = DEFAULT_PAGE,
     page_size: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Get a single page of prospects.
+    Pass the next_cursor of a page as cursor to get the following page, this
+    is faster than page numbers on deep pages. Counting the total can be
+    skipped with include_total=false.
+    """
+    if not current_user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Please log in"
+        )
+    after_id = decode_cursor(cursor) if cursor else None
+    prospects = await ProspectCrud.get_users_prospects_async(
+        db, current_user.id, page, page_size, after_id
+    )
+    total = (
+        await ProspectCrud.get_user_prospects_total_async(db, current_user.id)
+        if include_total
+        else None
+    )
+    return {
+        "prospects": prospects,
+        "size": len(prospects),
+        "total": total,
+        "next_cursor": next_cursor(prospects, page_size),
+    }
+
+
+@router.get("/prospects/export", response_class=StreamingResponse)
+async def export_prospects(
+    current_user: schemas.User = Depends(get_current_user),
+    export_format: schemas.ExportFormat = Query(
+        schemas.ExportFormat.csv, alias="format"
+    ),
+    campaign_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Download all of user's prospects, or only the ones in a campaign, as CSV
+    or as NDJSON (one JSON object per line). The file is streamed as it is
+    read from the database.
+    """
+    if not current_user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Please log in"
+        )
+
+    if campaign_id is not None:
+        campaign = await CampaignCrud.get_by_id_async(db, campaign_id)
+        if not campaign:
+            raise HTTPException(
+                status.HTTP_404_NOT_FOUND,
+                detail=f"Campaign with id {campaign_id} does not exist",
+            )
+        if campaign.user_id != current_user.id:
+            raise HTTPException(
+                status.HTTP_403_FORBIDDEN,
+                detail=f"You do not have access to that campaign",
+            )
+
+    # the export reads from its own session, release this one meanwhile
+    await db.close()
+
+    return StreamingResponse(
+        exporter.export_prospects(current_user.id, campaign_id, export_format),
+        media_type=exporter.MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="prospects.{export_format.value}"'
+        },
+    )
+
+
+@router.post("/prospects/bulk", response_model=schemas.BulkProspectsResponse)
+async def bulk_upsert_prospects(
+    request: Request,
+    force: bool = False,
+    current_user: schemas.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    """Get a single page of prospects"""
+    """
+    Create or update up to BULK_MAX_PROSPECTS prospects sent as a JSON array
+    (Content-Type: application/json) or as NDJSON, one JSON object per line
+    (Content-Type: application/x-ndjson). Objects hold an email and optionally
+    a first_name and a last_name. Existing prospects are updated if force is
+    set, skipped otherwise.
+
+    The body is parsed and validated as it arrives, then persisted in batches
+    within a single transaction. Invalid objects are rejected, duplicates
+    and existing prospects left as they are skipped, and both are counted; a
+    malformed or too large body persists nothing.
+    """
     if not current_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Please log in"
         )
-    prospects = ProspectCrud.get_users_prospects(db, current_user.id, page, page_size)
-    total = ProspectCrud.get_user_prospects_total(db, current_user.id)
-    return {"prospects": prospects, "size": len(prospects), "total": total}
+
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type == "application/json":
+        items = bulk_import.iter_json_array(request.stream())
+    elif content_type in ("application/x-ndjson", "application/ndjson"):
+        items = bulk_import.iter_ndjson(request.stream())
+    else:
+        log.info("HTTP_415_UNSUPPORTED_MEDIA_TYPE")
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Body must be application/json or application/x-ndjson. {content_type}",
+        )
+
+    try:
+        return await bulk_import.ingest(db, current_user.id, items, force)
+    except (bulk_import.BulkPayloadError, UnicodeDecodeError) as e:
+        log.info("HTTP_400_BAD_REQUEST")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except bulk_import.TooManyProspectsError:
+        log.info("HTTP_413_REQUEST_ENTITY_TOO_LARGE")
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Too many prospects (max allowed = {settings.BULK_MAX_PROSPECTS}).",
+        )
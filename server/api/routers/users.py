@@ -1,6 +1,7 @@
 # FastAPI
 from fastapi import APIRouter, HTTPException, status, Depends
 from sqlalchemy.orm.session import Session
+from starlette.concurrency import run_in_threadpool
 
 from api import schemas
 from api.core import security
@@ -24,12 +25,13 @@ def get_authenticated_user(
 
 
 @router.post("/users", response_model=schemas.RegisterResponse)
-def create_user(data: schemas.UserCreate, db: Session = Depends(get_db)):
+async def create_user(data: schemas.UserCreate, db: Session = Depends(get_db)):
     """Create a new user record in the database and send a registration confirmation email"""
-    db_user = UserCrud.get_user_by_email(db, data.email)
+    db_user = await run_in_threadpool(UserCrud.get_user_by_email, db, data.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    new_user = UserCrud.create_user(db, data)
+    password_digest = await security.get_password_hash_async(data.password)
+    new_user = await run_in_threadpool(UserCrud.create_user, db, data, password_digest)
 
     token = security.create_access_token(data={"sub": new_user.email})
 
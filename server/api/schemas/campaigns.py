@@ -32,7 +32,8 @@ class CampaignResponse(BaseModel):
 
     campaigns: List[Campaign]
     size: int
-    total: int
+    total: Optional[int]
+    next_cursor: Optional[str]
 
 
 class AddToCampaigns(BaseModel):
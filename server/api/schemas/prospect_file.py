@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import Enum
-from typing import Optional
+from typing import List, Optional
 from fastapi import status
 from pydantic import BaseModel
 
@@ -9,6 +9,7 @@ class ProspectFileStatus(str, Enum):
     scheduled = "scheduled"
     in_progress = "in_progress"
     done = "done"
+    failed = "failed"
 
 
 class ProspectFile(BaseModel):
@@ -25,6 +26,7 @@ class ProspectFile(BaseModel):
     rows_total: int
     rows_done: int
     uploaded_at: datetime
+    started_at: Optional[datetime]
     user_id: int
     status: ProspectFileStatus
     request_id: str
@@ -47,6 +49,17 @@ class ProspectFileCreate(BaseModel):
     status: ProspectFileStatus
 
 
+class UploadSessionCreate(BaseModel):
+    file_name: str
+    file_size: int
+    content_type: str = "text/csv"
+    email_index: int
+    first_name_index: Optional[int]
+    last_name_index: Optional[int]
+    force: Optional[bool]
+    has_headers: Optional[bool]
+
+
 # response models for endpoints
 class HateosLink(BaseModel):
     file_status: str
@@ -60,7 +73,31 @@ class ProspectFileCreatedResponse(BaseModel):
 class ProspectFileDoneResponse(BaseModel):
     total: int
     done: int
+    inserted: int
+    updated: int
+    rejected: int
 
 
 class ProspectFileStatusResponse(BaseModel):
     status: str
+
+
+class ProspectFileProgressResponse(BaseModel):
+    status: str
+    total: int
+    done: int
+    inserted: int
+    updated: int
+    rejected: int
+    rows_per_second: Optional[float]
+    eta_seconds: Optional[float]
+
+
+class UploadSessionResponse(BaseModel):
+    upload_id: str
+    file_name: str
+    file_size: int
+    chunk_size: int
+    chunks: int
+    received: List[int]
+    missing: List[int]
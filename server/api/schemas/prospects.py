@@ -1,5 +1,6 @@
 from datetime import datetime
-from typing import List
+from enum import Enum
+from typing import List, Optional
 from pydantic import validator
 
 from pydantic import BaseModel, EmailStr
@@ -58,4 +59,27 @@ class ProspectResponse(BaseModel):
 
     prospects: List[Prospect]
     size: int
-    total: int
+    total: Optional[int]
+    next_cursor: Optional[str]
+
+
+class BulkBatchCounts(BaseModel):
+    inserted: int
+    updated: int
+    skipped: int
+    rejected: int
+
+
+class BulkProspectsResponse(BaseModel):
+    """Counts of a bulk request, in total and for every batch"""
+
+    inserted: int
+    updated: int
+    skipped: int
+    rejected: int
+    batches: List[BulkBatchCounts]
+
+
+class ExportFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
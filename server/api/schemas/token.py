@@ -1,6 +1,8 @@
+from typing import Optional
 from pydantic import BaseModel
 from pydantic.networks import EmailStr
 
 
 class Token(BaseModel):
     sub: EmailStr
+    exp: Optional[int]
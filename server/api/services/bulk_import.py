@@ -0,0 +1,273 @@
+import codecs
+import json
+import tempfile
+from typing import IO, Any, AsyncIterator, Iterator, List, Optional, Tuple
+from pydantic.errors import EmailError
+from sqlalchemy.orm.session import Session
+from starlette.concurrency import run_in_threadpool
+from api.core.config import settings
+from api.crud.prospect import ProspectCrud
+from .persistor import add_to_batch
+from .row_validator import validate_row
+
+# largest JSON value or NDJSON line held while parsing a request body
+MAX_ITEM_SIZE = 64 * 1024
+
+# an item read as a CSV row of email, first name and last name
+ITEM_PARAMS = {
+    "email_index": 1,
+    "first_name_index": 2,
+    "last_name_index": 3,
+}
+
+WHITESPACE = " \t\n\r"
+
+# characters ending a JSON token
+DELIMITERS = set(WHITESPACE + ',:[]{}"')
+
+
+class BulkPayloadError(Exception):
+    """Raised when a request body is not a JSON array or NDJSON"""
+
+
+class TooManyProspectsError(Exception):
+    """Raised when a request body holds more than BULK_MAX_PROSPECTS prospects"""
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    Parse the values of a JSON array as its chunks arrive. Only the value
+    being parsed is held in memory, not the whole array.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    chunks = chunks.__aiter__()
+
+    buffer = ""
+    position = 0
+    exhausted = False
+    # what comes next: "[", a value (or "]" if the array is empty), "," or "]"
+    expected = "["
+
+    while True:
+        while position < len(buffer) and buffer[position] in WHITESPACE:
+            position += 1
+
+        if position < len(buffer):
+            char = buffer[position]
+            if expected == "[":
+                if char != "[":
+                    raise BulkPayloadError("The body must be a JSON array.")
+                position += 1
+                expected = "first"
+                continue
+            if expected in ("first", ",") and char == "]":
+                return
+            if expected == ",":
+                if char != ",":
+                    raise BulkPayloadError(f"Expected ',' or ']', got '{char}'.")
+                position += 1
+                expected = "value"
+                continue
+
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                # an unterminated string, or a token running to the end of the
+                # buffer, may only be cut by the end of the chunk
+                if exhausted or (
+                    not e.msg.startswith("Unterminated string")
+                    and token_ends(buffer, e.pos + 1)
+                ):
+                    raise BulkPayloadError(f"Invalid JSON: {e.msg}.")
+                end = None
+
+            # a value ending with the buffer (e.g. a number) may go on in the
+            # next chunk
+            if end is not None and (exhausted or token_ends(buffer, end)):
+                yield value
+                position = end
+                expected = ","
+                continue
+        elif exhausted:
+            raise BulkPayloadError("Unexpected end of the JSON array.")
+
+        # the next value needs more of the body
+        if len(buffer) - position > MAX_ITEM_SIZE:
+            raise BulkPayloadError(
+                f"Array values must be at most {MAX_ITEM_SIZE} bytes."
+            )
+        try:
+            chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            exhausted = True
+            chunk = b""
+        buffer = buffer[position:] + text.decode(chunk, final=exhausted)
+        position = 0
+
+
+def token_ends(buffer: str, position: int) -> bool:
+    """Whether the token at position ends in the buffer, i.e. a delimiter follows"""
+    return any(char in DELIMITERS for char in buffer[position:])
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    Parse the lines of an NDJSON body as its chunks arrive. Lines which are
+    not valid JSON are yielded as None, blank lines are skipped.
+    """
+    text = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+
+    async for chunk in chunks:
+        lines = (pending + text.decode(chunk)).split("\n")
+        pending = lines.pop()
+        if len(pending) > MAX_ITEM_SIZE:
+            raise BulkPayloadError(f"Lines must be at most {MAX_ITEM_SIZE} bytes.")
+        for line in lines:
+            if line.strip():
+                yield parse_line(line)
+
+    pending += text.decode(b"", final=True)
+    if pending.strip():
+        yield parse_line(pending)
+
+
+def parse_line(line: str) -> Any:
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError:
+        return None
+
+
+def parse_item(item: Any) -> Optional[Tuple[str, str, str]]:
+    """
+    Build the (email, first_name, last_name) tuple of the prospect described
+    by a JSON object, validated like a row of an imported file. None if the
+    item is invalid.
+    """
+    if not isinstance(item, dict):
+        return None
+
+    # missing or null names are empty, like the empty fields of a CSV row
+    row = [
+        item.get("email"),
+        item.get("first_name") if item.get("first_name") is not None else "",
+        item.get("last_name") if item.get("last_name") is not None else "",
+    ]
+    if not all(isinstance(field, str) for field in row):
+        return None
+
+    try:
+        return validate_row(row, ITEM_PARAMS)
+    except EmailError:
+        return None
+
+
+async def ingest(
+    db: Session, user_id: int, items: AsyncIterator[Any], force: bool
+) -> dict:
+    """
+    Validate and upsert prospects in batches of PERSIST_BATCH_SIZE items, the
+    way file imports do.
+
+    The whole body is read and validated before the transaction opens, so a
+    slow client never holds a connection nor row locks. The validated batches
+    are spooled to a temporary file meanwhile, a single batch is held in
+    memory. All the batches are then committed at once: a body which is
+    invalid or too large persists nothing.
+
+    Returns the counts of inserted, updated, skipped and rejected items, in
+    total and for every batch.
+    """
+    with tempfile.TemporaryFile(
+        "w+", encoding="utf-8", dir=settings.CSV_FILES_PATH
+    ) as spool:
+        await spool_batches(items, spool)
+        counts = await run_in_threadpool(persist_batches, db, user_id, spool, force)
+    return {
+        "inserted": sum(batch["inserted"] for batch in counts),
+        "updated": sum(batch["updated"] for batch in counts),
+        "skipped": sum(batch["skipped"] for batch in counts),
+        "rejected": sum(batch["rejected"] for batch in counts),
+        "batches": counts,
+    }
+
+
+async def spool_batches(items: AsyncIterator[Any], spool: IO[str]) -> None:
+    """
+    Split the items into batches of PERSIST_BATCH_SIZE items, each one made of
+    its valid prospects and its number of rejected items, and write them to
+    spool, one line per batch
+    """
+    prospects = []
+    rejected = 0
+    count = 0
+
+    async for item in items:
+        count += 1
+        if count > settings.BULK_MAX_PROSPECTS:
+            raise TooManyProspectsError()
+
+        prospect = parse_item(item)
+        if prospect is None:
+            rejected += 1
+        else:
+            prospects.append(prospect)
+
+        if count % settings.PERSIST_BATCH_SIZE == 0:
+            await run_in_threadpool(write_batch, spool, prospects, rejected)
+            prospects = []
+            rejected = 0
+
+    if prospects or rejected:
+        await run_in_threadpool(write_batch, spool, prospects, rejected)
+
+
+def write_batch(
+    spool: IO[str], prospects: List[Tuple[str, str, str]], rejected: int
+) -> None:
+    spool.write(json.dumps([prospects, rejected]) + "\n")
+
+
+def read_batches(spool: IO[str]) -> Iterator[Tuple[List[list], int]]:
+    """The batches written to spool, one at a time"""
+    spool.seek(0)
+    for line in spool:
+        prospects, rejected = json.loads(line)
+        yield prospects, rejected
+
+
+def persist_batches(
+    db: Session, user_id: int, spool: IO[str], force: bool
+) -> List[dict]:
+    """
+    Upsert the batches spooled by spool_batches in a single transaction,
+    return the counts of each one.
+    Valid prospects neither inserted nor updated are skipped: duplicates of
+    another item of the request, or existing prospects without force.
+    """
+    counts = []
+    try:
+        for prospects, rejected in read_batches(spool):
+            # rows of the batch, see add_to_batch
+            batch: dict = {}
+            for prospect in prospects:
+                add_to_batch(batch, prospect, force)
+
+            inserted, updated = ProspectCrud.upsert_prospects(
+                db, user_id, list(batch.values()), force, commit=False
+            )
+            counts.append(
+                {
+                    "inserted": inserted,
+                    "updated": updated,
+                    "skipped": len(prospects) - inserted - updated,
+                    "rejected": rejected,
+                }
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return counts
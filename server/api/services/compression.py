@@ -0,0 +1,92 @@
+import gzip
+import io
+from typing import BinaryIO, Optional
+from api.core.config import settings
+
+try:
+    import zstandard
+except ImportError:  # zstd uploads are rejected without the optional dependency
+    zstandard = None
+
+GZIP = "gzip"
+ZSTD = "zstd"
+
+# leading bytes of the supported compression formats
+MAGIC_BYTES = {
+    GZIP: b"\x1f\x8b",
+    ZSTD: b"\x28\xb5\x2f\xfd",
+}
+
+# extension of the stored files, by compression
+EXTENSIONS = {
+    None: ".csv",
+    GZIP: ".csv.gz",
+    ZSTD: ".csv.zst",
+}
+
+
+class DecompressedTooLargeError(Exception):
+    """Raised when a compressed file inflates beyond the configured MAX_FILE_SIZE"""
+
+
+def detect_compression(head: bytes) -> Optional[str]:
+    """Name the compression of a file from its first bytes, None if not compressed"""
+    for compression, magic in MAGIC_BYTES.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def is_supported(compression: Optional[str]) -> bool:
+    return compression != ZSTD or zstandard is not None
+
+
+def compression_of(file_path: str) -> Optional[str]:
+    """Name the compression of a stored file from its extension"""
+    for compression, extension in EXTENSIONS.items():
+        if compression is not None and file_path.endswith(extension):
+            return compression
+    return None
+
+
+class LimitedReader(io.RawIOBase):
+    """Reads a decompressing stream, failing once more than limit bytes came out"""
+
+    def __init__(self, stream: BinaryIO, limit: int):
+        self.stream = stream
+        self.limit = limit
+        self.size = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.stream.read(len(buffer))
+        self.size += len(data)
+        if self.size > self.limit:
+            raise DecompressedTooLargeError()
+        buffer[: len(data)] = data
+        return len(data)
+
+    def close(self) -> None:
+        self.stream.close()
+        super().close()
+
+
+def open_binary(file_path: str) -> BinaryIO:
+    """
+    Open a stored file for reading, decompressing it on the fly. At most
+    MAX_FILE_SIZE bytes are read out of a compressed file, so that a small
+    file inflating to a huge one cannot exhaust the server.
+    """
+    compression = compression_of(file_path)
+    if compression is None:
+        return open(file_path, "rb")
+
+    if compression == GZIP:
+        stream = gzip.open(file_path, "rb")
+    else:
+        stream = zstandard.ZstdDecompressor().stream_reader(open(file_path, "rb"))
+    return io.BufferedReader(
+        LimitedReader(stream, settings.MAX_FILE_SIZE), settings.UPLOAD_CHUNK_SIZE
+    )
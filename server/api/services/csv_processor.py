@@ -1,105 +1,283 @@
 import csv
-from pydantic import ValidationError
+import io
+import locale
+import mmap
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Iterator, List, Optional, TextIO, Tuple
+from pydantic.errors import EmailError
 from api.core.config import settings
-from api.schemas.prospects import ProspectCreate
 from api.core.logger import log
+from .compression import compression_of, open_binary
+from .row_validator import validate_row
 
+# (rows read, offset in the file right after the record, prospect) of a record
+Record = Tuple[int, int, Optional[Tuple[str, str, str]]]
 
-def process_csv_file(file_params: dict) -> dict:
+
+def iter_csv_records(
+    file_params: dict, offset: int = 0, rows: int = 0
+) -> Iterator[Record]:
+    """
+    Read the records of a CSV file in file order, see Record. Prospects are
+    None for invalid records.
+
+    Reading starts at the beginning of the file, or right after a record
+    previously yielded when given its offset and number of rows read, e.g. to
+    resume an interrupted import. Offsets of compressed files are offsets in
+    their decompressed content.
+
+    Files of at least CSV_PARALLEL_MIN_FILE_SIZE bytes are read from the
+    beginning by CSV_PARSE_WORKERS processes when more than one worker is
+    configured. Compressed files are decompressed as they are read, by a single
+    process.
+    """
+
+    if (
+        offset == 0
+        and settings.CSV_PARSE_WORKERS > 1
+        and compression_of(file_params["file_path"]) is None
+        and os.path.getsize(file_params["file_path"])
+        >= settings.CSV_PARALLEL_MIN_FILE_SIZE
+    ):
+        records = iter_csv_records_parallel(file_params, settings.CSV_PARSE_WORKERS)
+    else:
+        records = iter_csv_records_serial(file_params, offset, rows)
+
+    # limit the number of rows to configured value of API, reading one line
+    # past the limit before stopping
+    try:
+        for record in records:
+            if record[0] > settings.MAX_NUMBER_OF_ROWS + 1:
+                break
+            yield record
+    finally:
+        records.close()
+
+
+def iter_csv_records_serial(
+    file_params: dict, offset: int, rows: int
+) -> Iterator[Record]:
+    """Read the records of a CSV file in the calling process, see iter_csv_records"""
+
+    encoding = locale.getpreferredencoding(False)
+
+    with open_binary(file_params["file_path"]) as csvfile:
+        skip_to(csvfile, offset)
+        yield from read_records(
+            io.TextIOWrapper(csvfile, encoding=encoding, newline=""),
+            file_params,
+            encoding,
+            offset,
+            rows,
+            # if csv file has a header skip it
+            offset == 0 and file_params["has_headers"] == True,
+        )
+
+
+def skip_to(csvfile: BinaryIO, offset: int) -> None:
+    """Move to offset, reading up to it when the file is decompressed on the fly"""
+    if csvfile.seekable():
+        csvfile.seek(offset)
+        return
+
+    while offset > 0:
+        chunk = csvfile.read(min(offset, settings.UPLOAD_CHUNK_SIZE))
+        if not chunk:
+            break
+        offset -= len(chunk)
+
+
+def read_records(
+    csvfile: TextIO,
+    file_params: dict,
+    encoding: str,
+    offset: int,
+    rows: int,
+    skip_header: bool,
+) -> Iterator[Record]:
+    """
+    Parse and validate the records of a CSV text stream starting at the given
+    byte offset, with rows records read before it
+    """
+
+    # the csv reader pulls one line at a time and no more than a record needs,
+    # so the offset after the lines pulled so far is the end of the record
+    position = [offset]
+
+    def lines() -> Iterator[str]:
+        for line in csvfile:
+            position[0] += len(line) if line.isascii() else len(line.encode(encoding))
+            yield line
+
+    records = csv.reader(lines(), delimiter=",", quotechar='"')
+
+    if skip_header:
+        next(records, None)
+
+    for row in records:
+        rows += 1
+        yield rows, position[0], parse_row(row, file_params)
+
+
+def parse_row(row: list, file_params: dict) -> Optional[Tuple[str, str, str]]:
+    """
+    Build the (email, first_name, last_name) tuple of the prospect described
+    by a CSV row, None if the row is invalid
+    """
+    try:
+        return validate_row(row, file_params)
+    except EmailError as e:
+        log.error(str(e))
+        return None
+
+
+def iter_csv_records_parallel(file_params: dict, workers: int) -> Iterator[Record]:
     """
-    Process CSV file with given parameters
-
-    This utility method expects the following file parameters:
-        "file_path" - required
-        "email_index" - required
-        "first_name_index" - optional
-        "last_name_index" - optional
-        "has_headers" - optional
+    Read the records of a CSV file using a pool of worker processes, see
+    iter_csv_records.
+
+    The file is split into byte ranges ending on record boundaries, each range
+    is parsed and validated by a worker and the results are merged in file
+    order. The records are the same as the ones of the serial path.
+    """
+
+    # workers decode the ranges the same way the serial path decodes the file
+    encoding = locale.getpreferredencoding(False)
+
+    ranges = split_csv_file(
+        file_params["file_path"], workers * settings.CSV_RANGES_PER_WORKER
+    )
+    tasks = [
+        (file_params, start, end, encoding, index == 0)
+        for index, (start, end) in enumerate(ranges)
+    ]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_process_range, *task) for task in tasks]
+
+        # merge the results in order, the remaining ranges are dropped once
+        # the caller stops reading
+        try:
+            rows = 0
+            for future in futures:
+                for offset, prospect in future.result():
+                    rows += 1
+                    yield rows, offset, prospect
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def _process_range(
+    file_params: dict, start: int, end: int, encoding: str, is_first: bool
+) -> List[Tuple[int, Optional[Tuple[str, str, str]]]]:
+    """
+    Parse and validate the records of a byte range of a CSV file (runs in a
+    worker process). Returns the offset after each record and its
+    (email, first_name, last_name) tuple, None for invalid records.
+    """
+
+    with open(file_params["file_path"], "rb") as csvfile:
+        csvfile.seek(start)
+        data = csvfile.read(end - start)
+
+    records = read_records(
+        io.TextIOWrapper(io.BytesIO(data), encoding=encoding, newline=""),
+        file_params,
+        encoding,
+        start,
+        0,
+        # the header is the first record of the file
+        is_first and file_params["has_headers"] == True,
+    )
+    return [(offset, prospect) for _, offset, prospect in records]
+
+
+# a quoted field: a quote at the start of a field up to its closing quote.
+# Newlines found inside such a field do not end the record.
+QUOTED_FIELD = re.compile(rb'(?:^|(?<=[,\r\n]))"[^"]*(?:""[^"]*)*"?')
+
+
+def split_csv_file(file_path: str, parts: int) -> List[Tuple[int, int]]:
     """
+    Split a CSV file into at most the given number of (start, end) byte ranges
+    of similar size. Every range ends right after a newline which is not part
+    of a quoted field, so that ranges hold whole records.
+    """
+
+    size = os.path.getsize(file_path)
+    if size == 0:
+        return [(0, 0)]
+
+    with open(file_path, "rb") as csvfile, mmap.mmap(
+        csvfile.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        boundaries = _find_record_boundaries(data, size, parts)
+
+    return list(zip(boundaries, boundaries[1:]))
 
-    # a collection to hold the discovered prospects
-    prospects: set = set()
 
-    # count the number of lines in the csv file
-    total_number_of_lines: int = 0
+def _find_record_boundaries(data: mmap.mmap, size: int, parts: int) -> List[int]:
+    """Find the offsets splitting data into whole records, see split_csv_file"""
 
-    # read csv file from disk
-    with open(
-        file_params["file_path"], newline="", buffering=settings.BUFFER_SIZE
-    ) as csvfile:
+    boundaries = [0]
 
-        rows = csv.reader(csvfile, delimiter=",", quotechar='"')
+    # quoted fields are only looked for when the file contains quotes
+    quoted_fields = QUOTED_FIELD.finditer(data) if data.find(b'"') != -1 else iter(())
+    quoted = next(quoted_fields, None)
 
-        # if csv file has a header skip it
-        if file_params["has_headers"] == True:
-            next(rows, None)
+    step = max(size // parts, 1)
+    for part in range(1, parts):
+        target = max(part * step, boundaries[-1])
 
-        for row in rows:
-            # limit the number of rows to configured value of API
-            if total_number_of_lines > settings.MAX_NUMBER_OF_ROWS:
+        while True:
+            newline = data.find(b"\n", target)
+            if newline == -1:
                 break
 
-            # one more row is read
-            total_number_of_lines += 1
+            # skip the quoted fields which end before the newline
+            while quoted is not None and quoted.end() <= newline:
+                quoted = next(quoted_fields, None)
 
-            # skip invalid/malformed rows
-            if is_valid_row(row, file_params) == False:
+            # the newline is inside a quoted field, look after it
+            if quoted is not None and quoted.start() < newline:
+                target = quoted.end()
                 continue
+            break
 
-            try:
-                # get email
-                email = row[file_params["email_index"] - 1]
-
-                # get first name or default to empty string
-                if not file_params["first_name_index"]:
-                    first_name = ""
-                else:
-                    first_name = row[file_params["first_name_index"] - 1]
-
-                # get last name or default to empty string
-                if not file_params["last_name_index"]:
-                    last_name = ""
-                else:
-                    last_name = row[file_params["last_name_index"] - 1]
-
-                # create the prospect object and add to collection
-                prospects.add(
-                    ProspectCreate(
-                        email=email,
-                        first_name=first_name,
-                        last_name=last_name,
-                    )
-                )
-
-            except ValidationError as e:
-                log.error(e.errors()[0]["msg"])
-
-    # compose appropriate result and return
-    return {
-        "prospects": prospects,
-        "lines_read": total_number_of_lines,
-    }
-
-
-# Invalid if the number of columns discovered in the row
-# is less than any of the indices provided in the request.
-def is_valid_row(row: list, file_params: dict) -> bool:
-    """Validate a row in a CSV file. Mainly check if indices are not out of bound."""
-    try:
-        if (
-            file_params["email_index"] < 1
-            or file_params["email_index"] > len(row)
-            or (
-                file_params["first_name_index"] is not None
-                and file_params["first_name_index"] > len(row)
-            )
-            or (
-                file_params["last_name_index"] is not None
-                and file_params["last_name_index"] > len(row)
-            )
-        ):
-            raise ValueError("index out of bound.")
-        return True
-
-    except (ValueError):
-        return False
+        if newline == -1 or newline + 1 >= size:
+            break
+        boundaries.append(newline + 1)
+
+    boundaries.append(size)
+    return boundaries
+
+
+def count_rows(file_params: dict) -> int:
+    """
+    Estimate the number of rows iter_csv_records will read by counting newlines.
+    Quoted fields spanning several lines make this an over-estimate.
+    """
+
+    newlines = 0
+    last_byte = b"\n"
+
+    with open_binary(file_params["file_path"]) as csvfile:
+        while True:
+            chunk = csvfile.read(settings.UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            newlines += chunk.count(b"\n")
+            last_byte = chunk[-1:]
+
+    # the last line may not be terminated by a newline
+    rows = newlines + (last_byte != b"\n")
+
+    # the header is not counted as a row
+    if file_params["has_headers"] == True and rows > 0:
+        rows -= 1
+
+    # iter_csv_records stops once the limit is exceeded
+    return min(rows, settings.MAX_NUMBER_OF_ROWS + 1)
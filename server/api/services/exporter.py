@@ -0,0 +1,55 @@
+import csv
+import io
+import json
+from typing import AsyncIterator, List, Optional
+from api.core.config import settings
+from api.crud import ProspectCrud
+from api.database import AsyncSessionLocal
+from api.schemas import ExportFormat
+
+COLUMNS = ("id", "email", "first_name", "last_name", "created_at", "updated_at")
+
+MEDIA_TYPES = {
+    ExportFormat.csv: "text/csv",
+    ExportFormat.ndjson: "application/x-ndjson",
+}
+
+
+async def export_prospects(
+    user_id: int, campaign_id: Optional[int], export_format: ExportFormat
+) -> AsyncIterator[bytes]:
+    """
+    Stream all of user's prospects, or only the ones in a campaign, as CSV
+    (with a header) or as NDJSON, one chunk per EXPORT_BATCH_SIZE prospects.
+
+    The prospects are read through a server side cursor of a session of the
+    export, so memory use does not depend on the number of prospects.
+    """
+    if export_format == ExportFormat.csv:
+        # sent before querying, so that the response starts right away
+        yield to_csv([COLUMNS])
+        encode = to_csv
+    else:
+        encode = to_ndjson
+
+    async with AsyncSessionLocal() as db:
+        async for rows in ProspectCrud.stream_users_prospects_async(
+            db, user_id, campaign_id, settings.EXPORT_BATCH_SIZE
+        ):
+            yield encode([[serialize(value) for value in row] for row in rows])
+
+
+def serialize(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def to_csv(rows: List[list]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+def to_ndjson(rows: List[list]) -> bytes:
+    return "".join(json.dumps(dict(zip(COLUMNS, row))) + "\n" for row in rows).encode(
+        "utf-8"
+    )
@@ -0,0 +1,66 @@
+import hashlib
+import os
+import tempfile
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+from api.core.config import settings
+
+
+class FileTooLargeError(Exception):
+    """Raised when an upload grows beyond the configured MAX_FILE_SIZE"""
+
+
+def _write_chunk(out, digest, chunk: bytes) -> None:
+    """Append a chunk to the temp file and feed it to the running digest"""
+    digest.update(chunk)
+    out.write(chunk)
+
+
+async def save_upload(file: UploadFile) -> dict:
+    """
+    Stream an uploaded file to a temp file in the CSV file store.
+
+    The file is read in chunks of UPLOAD_CHUNK_SIZE bytes, so memory usage stays
+    constant whatever the size of the upload. The sha512 digest is computed in
+    the same pass and MAX_FILE_SIZE is enforced as bytes arrive.
+
+    Returns a dict with the following keys:
+        "upload_path" - path of the temp file (see discard_upload)
+        "file_size" - number of bytes received
+        "sha512_digest" - hex digest of the received bytes
+    """
+
+    digest = hashlib.sha512()
+    file_size = 0
+
+    fd, upload_path = tempfile.mkstemp(dir=settings.CSV_FILES_PATH, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(settings.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                # abort as soon as the upload exceeds the max size
+                file_size += len(chunk)
+                if file_size > settings.MAX_FILE_SIZE:
+                    raise FileTooLargeError()
+
+                await run_in_threadpool(_write_chunk, out, digest, chunk)
+    except BaseException:
+        discard_upload(upload_path)
+        raise
+
+    return {
+        "upload_path": upload_path,
+        "file_size": file_size,
+        "sha512_digest": digest.hexdigest(),
+    }
+
+
+def discard_upload(upload_path: str) -> None:
+    """Remove a temp upload file if it still exists"""
+    try:
+        os.remove(upload_path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,181 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from api.core.config import settings
+from api.core import metrics
+from api.core.logger import log
+from api.crud.prospect_file import ProspectFileCrud
+from api.database import ImportSessionLocal
+from api.schemas.prospect_file import ProspectFileStatus
+from . import uploads, worker
+from .tracker import ClaimLostError
+
+
+def make_worker_id() -> str:
+    """Identify a worker process across hosts"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Heartbeat(threading.Thread):
+    """
+    Periodically records that a claimed ProspectFile is still being processed,
+    using its own database session. Sets lost once the claim is lost: another
+    worker took the file over, or no heartbeat could be recorded for
+    IMPORT_STALE_AFTER seconds, so that the file may have been requeued.
+    """
+
+    def __init__(self, file_id: int, worker_id: str):
+        super().__init__(daemon=True)
+        self.file_id = file_id
+        self.worker_id = worker_id
+        self.stopped = threading.Event()
+        self.lost = threading.Event()
+
+    def run(self) -> None:
+        db = ImportSessionLocal()
+        last_beat = time.monotonic()
+        try:
+            while not self.stopped.wait(settings.IMPORT_HEARTBEAT_INTERVAL):
+                try:
+                    claimed = ProspectFileCrud.touch_prospect_file(
+                        db, self.file_id, self.worker_id
+                    )
+                except Exception:
+                    # retried at the next interval
+                    log.exception(
+                        f"Worker {self.worker_id} failed recording a heartbeat "
+                        f"for file {self.file_id}"
+                    )
+                    db.rollback()
+                    if time.monotonic() - last_beat < settings.IMPORT_STALE_AFTER:
+                        continue
+                    claimed = False
+
+                if not claimed:
+                    log.warning(f"Worker {self.worker_id} lost file {self.file_id}")
+                    self.lost.set()
+                    return
+                last_beat = time.monotonic()
+        finally:
+            db.close()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+
+
+def requeue_stale_jobs() -> int:
+    """Put back in the queue the jobs of workers which stopped sending heartbeats"""
+    db = ImportSessionLocal()
+    try:
+        return ProspectFileCrud.requeue_stale_prospect_files(
+            db,
+            datetime.now(timezone.utc) - timedelta(seconds=settings.IMPORT_STALE_AFTER),
+            settings.IMPORT_MAX_ATTEMPTS,
+        )
+    finally:
+        db.close()
+
+
+def run_next_job(worker_id: str) -> bool:
+    """Claim and process the next scheduled file. Returns False if the queue is empty."""
+    db = ImportSessionLocal()
+    try:
+        prospect_file = ProspectFileCrud.claim_next_prospect_file(
+            db, worker_id, settings.IMPORT_MAX_RUNNING_PER_USER
+        )
+        if prospect_file is None:
+            return False
+
+        log.info(f"Worker {worker_id} processing file {prospect_file.id}")
+        attempts = prospect_file.attempts
+
+        heartbeat = Heartbeat(prospect_file.id, worker_id)
+        heartbeat.start()
+        try:
+            worker.execute(
+                db, prospect_file.user_id, prospect_file.id, worker_id, heartbeat.lost
+            )
+        except ClaimLostError:
+            # the worker which took the file over processes it
+            log.warning(
+                f"Worker {worker_id} stopped processing file {prospect_file.id}, "
+                "claimed by another worker"
+            )
+        except Exception:
+            # e.g. a dropped connection or a deadlock: the job is put back in
+            # the queue and resumes from its last checkpoint
+            retry = attempts < settings.IMPORT_MAX_ATTEMPTS
+            log.exception(
+                f"Worker {worker_id} failed processing file {prospect_file.id}, "
+                f"attempt {attempts} of {settings.IMPORT_MAX_ATTEMPTS}"
+            )
+            db.rollback()
+            ProspectFileCrud.update_claimed_prospect_file(
+                db,
+                prospect_file.id,
+                worker_id,
+                {
+                    "status": (
+                        ProspectFileStatus.scheduled
+                        if retry
+                        else ProspectFileStatus.failed
+                    ),
+                    "claimed_by": None,
+                },
+            )
+        finally:
+            heartbeat.stop()
+
+        return True
+    finally:
+        db.close()
+
+
+def run_jobs(worker_id: str, stop: threading.Event) -> None:
+    """Process queued files one at a time until stop is set"""
+    while not stop.is_set():
+        if not run_next_job(worker_id):
+            stop.wait(settings.IMPORT_POLL_INTERVAL)
+
+
+def run_worker(
+    worker_id: Optional[str] = None, stop: Optional[threading.Event] = None
+) -> None:
+    """
+    Process queued files until stop is set, running up to
+    IMPORT_WORKER_CONCURRENCY of them at once
+    """
+    worker_id = worker_id or make_worker_id()
+    stop = stop or threading.Event()
+
+    log.info(f"Import worker {worker_id} started")
+    metrics.start_snapshot_writer()
+
+    slots = [
+        threading.Thread(target=run_jobs, args=(f"{worker_id}/{slot}", stop))
+        for slot in range(settings.IMPORT_WORKER_CONCURRENCY)
+    ]
+    for slot in slots:
+        slot.start()
+
+    while not stop.is_set():
+        # any worker recovers the jobs of crashed workers
+        requeued = requeue_stale_jobs()
+        if requeued:
+            log.info(f"Import worker {worker_id} requeued {requeued} stale jobs")
+        # and the resumable uploads abandoned by their clients
+        uploads.collect_abandoned_sessions(settings.UPLOAD_SESSION_TTL)
+
+        stop.wait(settings.IMPORT_STALE_AFTER)
+
+    # the slots finish their current job before exiting
+    for slot in slots:
+        slot.join()
+
+    metrics.write_snapshot()
+    log.info(f"Import worker {worker_id} stopped")
@@ -0,0 +1,178 @@
+import hashlib
+import os
+import struct
+import zlib
+from array import array
+from typing import Optional
+from api.core.config import settings
+from api.core.logger import log
+from api.core.metrics import Counter
+
+# bump when the format of the entries or the parsing rules change
+FORMAT_VERSION = 2
+
+MAGIC = b"PRC2"
+
+# magic, lines read, rows rejected, number of records
+HEADER = struct.Struct("<4sQQQ")
+
+PARSED_CACHE_LOOKUPS = Counter(
+    "import_parsed_cache_lookups_total",
+    "Number of lookups of parsed imports in the cache",
+    ("result",),
+)
+
+
+def cache_dir() -> str:
+    return os.path.join(settings.CSV_FILES_PATH, ".parsed")
+
+
+def cache_key(sha512_digest: str, file_params: dict) -> str:
+    """
+    Identify the result of parsing a file with a column mapping. Everything
+    which changes the parsed rows is part of the key.
+    """
+    parts = [
+        sha512_digest,
+        file_params["email_index"],
+        file_params["first_name_index"],
+        file_params["last_name_index"],
+        bool(file_params["has_headers"]),
+        settings.MAX_NUMBER_OF_ROWS,
+        FORMAT_VERSION,
+    ]
+    return hashlib.sha256(":".join(map(str, parts)).encode()).hexdigest()
+
+
+def enabled() -> bool:
+    return settings.PARSED_CACHE_MAX_BYTES > 0
+
+
+def load(key: str) -> Optional[dict]:
+    """
+    Return the parsed import stored under key, None if missing.
+    A hit makes the entry the most recently used one.
+    """
+    if not enabled():
+        return None
+
+    path = os.path.join(cache_dir(), key)
+    try:
+        with open(path, "rb") as entry:
+            data = entry.read()
+    except FileNotFoundError:
+        PARSED_CACHE_LOOKUPS.inc(labels=("miss",))
+        return None
+
+    try:
+        result = decode(data)
+    except (ValueError, struct.error, zlib.error):
+        log.warning(f"Dropping corrupted parsed cache entry {key}")
+        discard(path)
+        PARSED_CACHE_LOOKUPS.inc(labels=("miss",))
+        return None
+
+    # eviction removes the least recently modified entries first
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    PARSED_CACHE_LOOKUPS.inc(labels=("hit",))
+    return result
+
+
+def store(key: str, result: dict) -> None:
+    """
+    Store a parsed import under key, then enforce the size limit. The result
+    holds the "lines_read", the "rows_rejected" and, in file order, the
+    "records" of the valid rows as yielded by iter_csv_records.
+    """
+    if not enabled():
+        return
+
+    os.makedirs(cache_dir(), exist_ok=True)
+    path = os.path.join(cache_dir(), key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as entry:
+        entry.write(encode(result))
+    os.replace(tmp_path, path)
+
+    evict(settings.PARSED_CACHE_MAX_BYTES)
+
+
+def encode(result: dict) -> bytes:
+    """
+    Header followed by the zlib compressed rows read and offset of every
+    record, the length (in characters) of every field, then the fields
+    themselves, concatenated in UTF-8
+    """
+    records = result["records"]
+    rows = array("Q", (record[0] for record in records))
+    offsets = array("Q", (record[1] for record in records))
+    lengths = array("I", (len(field) for record in records for field in record[2]))
+    text = "".join(field for record in records for field in record[2])
+
+    header = HEADER.pack(
+        MAGIC, result["lines_read"], result.get("rows_rejected", 0), len(records)
+    )
+    payload = rows.tobytes() + offsets.tobytes() + lengths.tobytes()
+    return header + zlib.compress(payload + text.encode("utf-8"))
+
+
+def decode(data: bytes) -> dict:
+    magic, lines_read, rows_rejected, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a parsed cache entry")
+
+    payload = zlib.decompress(data[HEADER.size :])
+    rows = array("Q")
+    offsets = array("Q")
+    lengths = array("I")
+    position = 0
+    for values, size in ((rows, count), (offsets, count), (lengths, 3 * count)):
+        values.frombytes(payload[position : position + size * values.itemsize])
+        position += size * values.itemsize
+    text = payload[position:].decode("utf-8")
+
+    fields = []
+    position = 0
+    for length in lengths:
+        fields.append(text[position : position + length])
+        position += length
+    if position != len(text) or len(lengths) != 3 * count:
+        raise ValueError("Truncated parsed cache entry")
+
+    prospects = zip(fields[0::3], fields[1::3], fields[2::3])
+    return {
+        "records": list(zip(rows, offsets, prospects)),
+        "lines_read": lines_read,
+        "rows_rejected": rows_rejected,
+    }
+
+
+def evict(max_bytes: int) -> None:
+    """Remove the least recently used entries until the cache fits in max_bytes"""
+    entries = []
+    with os.scandir(cache_dir()) as scan:
+        for entry in scan:
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        discard(path)
+        total -= size
+
+
+def discard(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -1,48 +1,13 @@
-from typing import Set
-from sqlalchemy.orm.session import Session
-from api.schemas.prospects import Prospect
-from api.crud.prospect import ProspectCrud
-
-
-def persist(db: Session, prospects: set, params: dict) -> Set[Prospect]:
+def add_to_batch(batch: dict, prospect: tuple, force: bool) -> None:
     """
-    Persists a collection of Prospects.
-    Updates if Prospect already exists and the 'force' flag is set.
+    Add an (email, first_name, last_name) tuple to a batch of rows keyed by
+    email, a statement cannot touch a row twice: the last row of an email wins
+    if force is set, the first one otherwise, as the upsert does across batches
     """
-
-    persisted_prospects: Set[Prospect] = set()
-
-    # iterate over the discovered prospects and persist
-    for prospect in prospects:
-
-        data = {
-            "email": prospect.email,
-            "first_name": prospect.first_name,
-            "last_name": prospect.last_name,
+    email, first_name, last_name = prospect
+    if force or email not in batch:
+        batch[email] = {
+            "email": email,
+            "first_name": first_name,
+            "last_name": last_name,
         }
-
-        # check if prospect with same email exists
-        existing_prospect = ProspectCrud.get_prospect_by_email(
-            db, params["user_id"], prospect.email
-        )
-
-        # if there is a prospect with same email and the force flag is true
-        if existing_prospect is not None:
-            if params["force"] == True:
-                persisted_prospects.add(
-                    ProspectCrud.update_prospect(
-                        db,
-                        params["user_id"],
-                        data,
-                    )
-                )
-        else:
-            persisted_prospects.add(
-                ProspectCrud.create_prospect(
-                    db,
-                    params["user_id"],
-                    data,
-                )
-            )
-
-    return persisted_prospects
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+from typing import Dict, List, Optional, Set
+from api.core.config import settings
+from api.core.logger import log
+from api.crud.prospect_file import ProspectFileCrud
+from api.database import AsyncSessionLocal
+
+# fields of a prospect file describing its progress, see tracker.progress_of
+PROGRESS_FIELDS = (
+    "status",
+    "rows_total",
+    "rows_done",
+    "started_at",
+    "rows_rejected",
+    "rows_inserted",
+    "rows_updated",
+)
+
+
+def state_of(prospect_file) -> dict:
+    return {field: getattr(prospect_file, field) for field in PROGRESS_FIELDS}
+
+
+class Subscription:
+    """The latest progress of an import, for one subscriber running on loop"""
+
+    def __init__(self, file_id: int, loop: asyncio.AbstractEventLoop):
+        self.file_id = file_id
+        self.loop = loop
+        self.state: Optional[dict] = None
+        self.changed = asyncio.Event()
+
+    def push(self, state: dict) -> None:
+        """Record the latest progress, from any thread"""
+        try:
+            self.loop.call_soon_threadsafe(self._set, state)
+        except RuntimeError:
+            # the loop of the subscriber is closed
+            pass
+
+    def _set(self, state: dict) -> None:
+        self.state = state
+        self.changed.set()
+
+    async def wait(self, timeout: float) -> Optional[dict]:
+        """Wait up to timeout seconds for a new progress, None if none came"""
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self.changed.clear()
+        return self.state
+
+
+class ProgressHub:
+    """
+    Publish/subscribe of the progress of the imports, by prospect file id.
+    Imports running in this process publish their progress as they write it.
+    The progress of the imports running in other processes is read from the
+    database every PROGRESS_STREAM_POLL_INTERVAL seconds, in a single query
+    for all the subscriptions of the process.
+    """
+
+    def __init__(self):
+        self._subscriptions: Dict[int, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self._poller: Optional[asyncio.Task] = None
+
+    def subscribe(self, file_id: int) -> Subscription:
+        """Subscribe to the progress of an import, from the event loop"""
+        subscription = Subscription(file_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.setdefault(file_id, set()).add(subscription)
+
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.file_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.file_id, None)
+
+    def subscribed(self) -> List[int]:
+        with self._lock:
+            return list(self._subscriptions)
+
+    def publish(self, file_id: int, state: dict) -> None:
+        """Send the progress of an import to its subscribers, from any thread"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(file_id, ()))
+        for subscription in subscriptions:
+            subscription.push(state)
+
+    async def _poll(self) -> None:
+        """Publish the progress stored in the database until nobody subscribes"""
+        while True:
+            await asyncio.sleep(settings.PROGRESS_STREAM_POLL_INTERVAL)
+            file_ids = self.subscribed()
+            if not file_ids:
+                return
+
+            try:
+                async with AsyncSessionLocal() as db:
+                    prospect_files = await ProspectFileCrud.get_progress_by_ids_async(
+                        db, file_ids
+                    )
+            except Exception:
+                log.exception("Failed reading the progress of the streamed imports")
+                continue
+
+            for prospect_file in prospect_files:
+                self.publish(prospect_file.id, state_of(prospect_file))
+
+
+hub = ProgressHub()
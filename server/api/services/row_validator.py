@@ -0,0 +1,108 @@
+import re
+from functools import lru_cache
+from typing import Optional, Tuple
+from pydantic import EmailStr, errors
+from api.core.config import settings
+
+try:
+    # local parts email-validator lower cases (email-validator >= 2.1)
+    from email_validator.rfc_constants import CASE_INSENSITIVE_MAILBOX_NAMES
+except ImportError:
+    CASE_INSENSITIVE_MAILBOX_NAMES = []
+
+# printable ASCII characters allowed in an unquoted local part (RFC 5322 atext)
+ATEXT = r"a-zA-Z0-9_!#\$%&'\*\+\-/=\?\^`\{\|\}~"
+
+# the common shape of an email: dot-atom local part and a plain ASCII domain.
+# Any other value is checked by the full EmailStr validation.
+SIMPLE_EMAIL = re.compile(rf"([{ATEXT}]+(?:\.[{ATEXT}]+)*)@([a-zA-Z0-9.\-]+)")
+
+# longest email and local part accepted by the fast path
+MAX_EMAIL_LENGTH = 254
+MAX_LOCAL_PART_LENGTH = 64
+
+
+def validate_email(value: str) -> str:
+    """
+    Validate and normalize an email the same way EmailStr does, raise
+    pydantic.errors.EmailError if it is invalid.
+
+    Emails of the common shape only go through a precompiled regex, their
+    domain is validated once and then served from a cache.
+    """
+    m = SIMPLE_EMAIL.fullmatch(value)
+    if (
+        m is None
+        or len(value) > MAX_EMAIL_LENGTH
+        or len(m.group(1)) > MAX_LOCAL_PART_LENGTH
+        or m.group(1).lower() in CASE_INSENSITIVE_MAILBOX_NAMES
+    ):
+        return EmailStr.validate(value)
+
+    domain = validate_domain(m.group(2))
+    if domain is None:
+        raise errors.EmailError()
+    return f"{m.group(1)}@{domain}"
+
+
+@lru_cache(maxsize=settings.EMAIL_DOMAIN_CACHE_SIZE)
+def validate_domain(domain: str) -> Optional[str]:
+    """Return the normalized form of an email domain, None if it is invalid"""
+    try:
+        # the local part is a plain atom, only the domain can fail
+        return EmailStr.validate(f"a@{domain}").split("@", 1)[1]
+    except errors.EmailError:
+        return None
+
+
+def validate_row(row: list, file_params: dict) -> Optional[Tuple[str, str, str]]:
+    """
+    Extract the prospect described by a CSV row as an
+    (email, first_name, last_name) tuple, None if the row is invalid.
+    """
+
+    # skip invalid/malformed rows
+    if is_valid_row(row, file_params) == False:
+        return None
+
+    # get first name or default to empty string
+    if not file_params["first_name_index"]:
+        first_name = ""
+    else:
+        first_name = row[file_params["first_name_index"] - 1]
+
+    # get last name or default to empty string
+    if not file_params["last_name_index"]:
+        last_name = ""
+    else:
+        last_name = row[file_params["last_name_index"] - 1]
+
+    return (
+        validate_email(row[file_params["email_index"] - 1]),
+        first_name,
+        last_name,
+    )
+
+
+# Invalid if the number of columns discovered in the row
+# is less than any of the indices provided in the request.
+def is_valid_row(row: list, file_params: dict) -> bool:
+    """Validate a row in a CSV file. Mainly check if indices are not out of bound."""
+    try:
+        if (
+            file_params["email_index"] < 1
+            or file_params["email_index"] > len(row)
+            or (
+                file_params["first_name_index"] is not None
+                and file_params["first_name_index"] > len(row)
+            )
+            or (
+                file_params["last_name_index"] is not None
+                and file_params["last_name_index"] > len(row)
+            )
+        ):
+            raise ValueError("index out of bound.")
+        return True
+
+    except ValueError:
+        return False
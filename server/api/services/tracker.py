@@ -1,6 +1,97 @@
+import json
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from threading import Event
+from typing import AsyncIterator, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.session import Session
+from api.core.config import settings
 from api.crud.prospect_file import ProspectFileCrud
 from api.schemas.prospect_file import ProspectFileStatus
+from .progress_hub import hub
+
+# columns of a prospect file counting the outcome of its rows
+COUNT_FIELDS = ("rows_rejected", "rows_inserted", "rows_updated")
+
+
+class ClaimLostError(Exception):
+    """Raised when another worker took over the import being processed"""
+
+
+class ProgressReporter:
+    """
+    Publishes the progress of a running import to the database and to the
+    subscribers of the progress hub, as long as the worker holds the claim of
+    the import. The claim is lost once lost is set (by the heartbeat of the
+    job) or once the import was claimed by another worker.
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        file_id: int,
+        worker_id: str,
+        total: int,
+        started_at: Optional[datetime] = None,
+        lost: Optional[Event] = None,
+    ):
+        self.db = db
+        self.file_id = file_id
+        self.worker_id = worker_id
+        self.lost = lost or Event()
+        self.total = total
+        self.started_at = started_at
+        self.status = ProspectFileStatus.in_progress
+        # counts of the rows rejected and of the prospects inserted and updated
+        self.counts = {field: 0 for field in COUNT_FIELDS}
+
+    def publish(self, done: int, fields: Optional[dict] = None) -> None:
+        """
+        Write the progress, done being the number of rows read, to the database
+        along with the given fields (e.g. the checkpoint and the counts of the
+        import). This commits the transaction of the session, or rolls it back
+        and raises ClaimLostError if the claim was lost.
+        """
+        self.ensure_claimed()
+        fields = fields or {}
+        self.counts.update(
+            {field: fields[field] for field in COUNT_FIELDS if field in fields}
+        )
+
+        # the pre-counted total is an estimate, never report more done than total
+        self.total = max(self.total, done)
+
+        if not ProspectFileCrud.update_claimed_prospect_file(
+            self.db,
+            self.file_id,
+            self.worker_id,
+            {**fields, "rows_total": self.total, "rows_done": done},
+        ):
+            raise ClaimLostError()
+
+        hub.publish(
+            self.file_id,
+            {
+                "status": self.status,
+                "rows_total": self.total,
+                "rows_done": done,
+                "started_at": self.started_at,
+                **self.counts,
+            },
+        )
+
+    def ensure_claimed(self) -> None:
+        """Raise ClaimLostError, rolling back the transaction, if the claim was lost"""
+        if self.lost.is_set():
+            self.db.rollback()
+            raise ClaimLostError()
+
+    def finish(self, total: int) -> None:
+        """Publish the final number of rows of the import and mark it done"""
+        self.status = ProspectFileStatus.done
+        self.total = total
+        self.publish(total, {"status": self.status})
 
 
 def track_progress(request_id: str, user_id: int, db: Session):
@@ -11,18 +102,121 @@ def track_progress(request_id: str, user_id: int, db: Session):
         db, request_id, user_id
     )
 
+    return progress_of(prospect_file)
+
+
+async def track_progress_async(request_id: str, user_id: int, db: AsyncSession):
+    """Tracks prospect file progress, see track_progress"""
+
+    # pull file out of db
+    prospect_file = await ProspectFileCrud.get_prospect_file_by_request_id_async(
+        db, request_id, user_id
+    )
+
+    return progress_of(prospect_file)
+
+
+def progress_of(prospect_file):
+    """Compose the progress response of a prospect file"""
+
     # if file does not exist, return None
     if prospect_file is None:
         return None
 
-    # processing is completed -> return total and done
+    # processing is completed -> return total, done and the counts
     if prospect_file.status == ProspectFileStatus.done:
         return {
             "total": prospect_file.rows_total,
             "done": prospect_file.rows_done,
+            **counts_of(prospect_file),
+        }
+    # processing is running -> return live progress
+    elif prospect_file.status == ProspectFileStatus.in_progress:
+        return {
+            "status": prospect_file.status,
+            "total": prospect_file.rows_total,
+            "done": prospect_file.rows_done,
+            **counts_of(prospect_file),
+            **estimate_rate(prospect_file),
         }
-    # processing is not done -> return status
+    # processing is not started -> return status
     else:
         return {
             "status": prospect_file.status,
         }
+
+
+def counts_of(prospect_file) -> dict:
+    """The rows rejected and the prospects inserted and updated so far"""
+    return {
+        "inserted": prospect_file.rows_inserted,
+        "updated": prospect_file.rows_updated,
+        "rejected": prospect_file.rows_rejected,
+    }
+
+
+def estimate_rate(prospect_file) -> dict:
+    """Compute the processing rate and the remaining time of a running import"""
+    rows_per_second = None
+    eta_seconds = None
+
+    if prospect_file.started_at is not None:
+        elapsed = (
+            datetime.now(timezone.utc) - prospect_file.started_at
+        ).total_seconds()
+        if elapsed > 0 and prospect_file.rows_done > 0:
+            rows_per_second = prospect_file.rows_done / elapsed
+            eta_seconds = (
+                max(prospect_file.rows_total - prospect_file.rows_done, 0)
+                / rows_per_second
+            )
+
+    return {
+        "rows_per_second": rows_per_second,
+        "eta_seconds": eta_seconds,
+    }
+
+
+async def progress_events(file_id: int, state: dict) -> AsyncIterator[str]:
+    """
+    Stream the progress of a prospect file as Server-Sent Events, starting
+    with its given state, until it is done or failed. Identical states are
+    sent once, a keep-alive comment is sent after PROGRESS_STREAM_KEEPALIVE
+    seconds without writing anything.
+    """
+    subscription = hub.subscribe(file_id)
+    sent = None
+    written_at = time.monotonic()
+    try:
+        while True:
+            if state is not None and state != sent:
+                yield progress_event(state)
+                sent = state
+                written_at = time.monotonic()
+                if state["status"] in (
+                    ProspectFileStatus.done,
+                    ProspectFileStatus.failed,
+                ):
+                    return
+            elif time.monotonic() - written_at >= settings.PROGRESS_STREAM_KEEPALIVE:
+                # keep the connection open through proxies, the poller of the
+                # hub publishes unchanged states meanwhile
+                yield ": keep-alive\n\n"
+                written_at = time.monotonic()
+
+            state = await subscription.wait(
+                max(
+                    written_at + settings.PROGRESS_STREAM_KEEPALIVE - time.monotonic(),
+                    0,
+                )
+            )
+    finally:
+        hub.unsubscribe(subscription)
+
+
+def progress_event(state: dict) -> str:
+    """Format a progress state as a Server-Sent Event named after its status"""
+    status = ProspectFileStatus(state["status"])
+    progress = {"status": status.value, **progress_of(SimpleNamespace(**state))}
+    event = "progress" if status == ProspectFileStatus.in_progress else status.value
+    return f"event: {event}\ndata: {json.dumps(progress)}\n\n"
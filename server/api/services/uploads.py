@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from typing import AsyncIterator, List
+from starlette.concurrency import run_in_threadpool
+from api.core.config import settings
+from api.core.logger import log
+
+UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+SESSION_FILE = "session.json"
+DATA_FILE = "data.part"
+CHUNK_MARKER = ".chunk"
+
+# suffix of the directory of a session claimed by its completion
+COMPLETED = ".completed"
+
+# the directories of the sessions, open or completed
+SESSION_DIR = re.compile(rf"^[0-9a-f]{{32}}({re.escape(COMPLETED)})?$")
+
+
+class UploadSessionNotFoundError(Exception):
+    """Raised when an upload session does not exist or belongs to another user"""
+
+
+class ChunkError(Exception):
+    """Raised when a chunk has a wrong index, size or checksum"""
+
+
+class UploadIncompleteError(Exception):
+    """Raised when completing an upload session which misses chunks"""
+
+
+class UploadCompletedError(Exception):
+    """Raised when using an upload session already completed, or being completed"""
+
+
+def uploads_dir() -> str:
+    return os.path.join(settings.CSV_FILES_PATH, "uploads")
+
+
+def session_dir(upload_id: str) -> str:
+    return os.path.join(uploads_dir(), upload_id)
+
+
+def completed_dir(upload_id: str) -> str:
+    return session_dir(upload_id) + COMPLETED
+
+
+def create_session(user_id: int, meta_data: dict) -> dict:
+    """
+    Start a resumable upload of meta_data["file_size"] bytes. The session is a
+    directory holding its meta data, the file being assembled and one marker
+    per received chunk.
+    """
+    session = {
+        **meta_data,
+        "upload_id": uuid.uuid4().hex,
+        "user_id": user_id,
+        "chunk_size": settings.UPLOAD_SESSION_CHUNK_SIZE,
+        "created_at": time.time(),
+    }
+
+    path = session_dir(session["upload_id"])
+    os.makedirs(path)
+    # chunks are written at their offset, in any order
+    with open(os.path.join(path, DATA_FILE), "wb") as data:
+        data.truncate(session["file_size"])
+    with open(os.path.join(path, SESSION_FILE), "w") as session_file:
+        json.dump(session, session_file)
+
+    return session
+
+
+def load_session(upload_id: str, user_id: int) -> dict:
+    """
+    Read the upload session of the user. Raises UploadCompletedError if it
+    was completed, or is being completed.
+    """
+    if not UPLOAD_ID.match(upload_id):
+        raise UploadSessionNotFoundError()
+    for path, completed in (
+        (session_dir(upload_id), False),
+        (completed_dir(upload_id), True),
+    ):
+        try:
+            with open(os.path.join(path, SESSION_FILE)) as session_file:
+                session = json.load(session_file)
+            break
+        except FileNotFoundError:
+            continue
+    else:
+        raise UploadSessionNotFoundError()
+    if session["user_id"] != user_id:
+        raise UploadSessionNotFoundError()
+    if completed:
+        raise UploadCompletedError()
+    return session
+
+
+def chunk_count(session: dict) -> int:
+    return max(1, -(-session["file_size"] // session["chunk_size"]))
+
+
+def chunk_length(session: dict, index: int) -> int:
+    start = index * session["chunk_size"]
+    return min(session["chunk_size"], session["file_size"] - start)
+
+
+def received_chunks(session: dict) -> List[int]:
+    path = session_dir(session["upload_id"])
+    return sorted(
+        int(name[: -len(CHUNK_MARKER)])
+        for name in os.listdir(path)
+        if name.endswith(CHUNK_MARKER)
+    )
+
+
+def session_status(session: dict) -> dict:
+    """Describe an upload session and the chunks still to be sent"""
+    received = received_chunks(session)
+    return {
+        "upload_id": session["upload_id"],
+        "file_name": session["file_name"],
+        "file_size": session["file_size"],
+        "chunk_size": session["chunk_size"],
+        "chunks": chunk_count(session),
+        "received": received,
+        "missing": sorted(set(range(chunk_count(session))) - set(received)),
+    }
+
+
+async def write_chunk(
+    session: dict, index: int, body: AsyncIterator[bytes], sha256_digest: str
+) -> None:
+    """
+    Stream a chunk of the upload to its offset in the assembled file. The chunk
+    is only recorded as received if its size and sha256 digest are the expected
+    ones, otherwise it has to be sent again.
+    """
+    if not 0 <= index < chunk_count(session):
+        raise ChunkError(
+            f"Chunk index must be between 0 and {chunk_count(session) - 1}"
+        )
+
+    expected = chunk_length(session, index)
+    offset = index * session["chunk_size"]
+    path = session_dir(session["upload_id"])
+    data_path = os.path.join(path, DATA_FILE)
+    marker_path = os.path.join(path, f"{index}{CHUNK_MARKER}")
+
+    # a chunk sent again overwrites the received one, which is lost if it fails
+    if os.path.exists(marker_path):
+        os.remove(marker_path)
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        data = open(data_path, "r+b")
+    except FileNotFoundError:
+        # the session was completed meanwhile
+        raise UploadCompletedError()
+    with data:
+        data.seek(offset)
+        async for piece in body:
+            size += len(piece)
+            if size > expected:
+                raise ChunkError(f"Chunk {index} must be {expected} bytes")
+            digest.update(piece)
+            await run_in_threadpool(data.write, piece)
+
+    if size != expected:
+        raise ChunkError(f"Chunk {index} must be {expected} bytes, got {size}")
+    if digest.hexdigest() != sha256_digest.lower():
+        raise ChunkError(f"Chunk {index} does not match its checksum")
+
+    open(marker_path, "w").close()
+    # the session is active, see collect_abandoned_sessions
+    os.utime(path)
+
+
+def assemble(session: dict) -> dict:
+    """
+    Move the assembled file of a complete session out of it, the same way
+    save_upload stores an upload.
+
+    The session is first claimed by renaming its directory, so that it is
+    completed once: a concurrent or later completion raises
+    UploadCompletedError. Its meta data is kept, until the session is
+    collected, to tell a completed session from an unknown one.
+
+    Returns a dict with the keys "upload_path", "file_size" and "sha512_digest".
+    """
+    try:
+        received = received_chunks(session)
+    except FileNotFoundError:
+        # claimed by another completion meanwhile
+        raise UploadCompletedError()
+    if len(received) != chunk_count(session):
+        raise UploadIncompleteError()
+
+    path = session_dir(session["upload_id"])
+    claimed = completed_dir(session["upload_id"])
+    try:
+        os.rename(path, claimed)
+    except FileNotFoundError:
+        raise UploadCompletedError()
+    # collected UPLOAD_SESSION_TTL seconds after its completion
+    os.utime(claimed)
+
+    data_path = os.path.join(claimed, DATA_FILE)
+    try:
+        digest = hashlib.sha512()
+        with open(data_path, "rb") as data:
+            while True:
+                chunk = data.read(settings.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+
+        fd, upload_path = tempfile.mkstemp(dir=settings.CSV_FILES_PATH, suffix=".part")
+        os.close(fd)
+        os.replace(data_path, upload_path)
+    except BaseException:
+        # the session can be completed again
+        os.rename(claimed, path)
+        raise
+
+    for name in os.listdir(claimed):
+        if name != SESSION_FILE:
+            os.remove(os.path.join(claimed, name))
+
+    return {
+        "upload_path": upload_path,
+        "file_size": session["file_size"],
+        "sha512_digest": digest.hexdigest(),
+    }
+
+
+def discard_session(session: dict) -> None:
+    shutil.rmtree(session_dir(session["upload_id"]), ignore_errors=True)
+
+
+def collect_abandoned_sessions(max_age: float) -> int:
+    """
+    Remove the sessions which received nothing for max_age seconds, and the
+    sessions completed max_age seconds ago
+    """
+    try:
+        entries = list(os.scandir(uploads_dir()))
+    except FileNotFoundError:
+        return 0
+
+    removed = 0
+    for entry in entries:
+        try:
+            abandoned = time.time() - entry.stat().st_mtime > max_age
+        except FileNotFoundError:
+            continue
+        if entry.is_dir() and SESSION_DIR.match(entry.name) and abandoned:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            log.info(f"Removed abandoned upload session {entry.name}")
+            removed += 1
+    return removed
@@ -1,76 +1,240 @@
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
 from sqlalchemy.orm.session import Session
+from api.core.config import settings
+from api.core.metrics import Counter, Histogram
 from api.schemas.prospect_file import ProspectFileStatus
-from api.crud import ProspectFileCrud
-from .csv_processor import process_csv_file
-from .persistor import persist
+from api.crud.prospect import ProspectCrud
+from api.crud.prospect_file import ProspectFileCrud
+from . import parsed_cache
+from .csv_processor import count_rows, iter_csv_records
+from .persistor import add_to_batch
+from .tracker import ProgressReporter
 
+IMPORT_ROWS_PARSED = Counter(
+    "import_rows_parsed_total", "Number of CSV rows read by the imports"
+)
+IMPORT_ROWS_REJECTED = Counter(
+    "import_rows_rejected_total", "Number of invalid CSV rows skipped by the imports"
+)
+IMPORT_ROWS_PERSISTED = Counter(
+    "import_rows_persisted_total",
+    "Number of prospects created or updated by the imports",
+)
+IMPORT_ROWS_PER_SECOND = Histogram(
+    "import_rows_per_second",
+    "Throughput of the imports, in rows read per second",
+    buckets=(1000, 5000, 10000, 25000, 50000, 100000, 250000, 500000),
+)
+IMPORT_DURATION = Histogram(
+    "import_duration_seconds",
+    "Duration of the imports, by phase",
+    ("phase",),
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
 
-def execute(db: Session, user_id: int, file_id: int) -> dict:
+
+def execute(
+    db: Session,
+    user_id: int,
+    file_id: int,
+    worker_id: str,
+    lost: Optional[threading.Event] = None,
+) -> dict:
     """
     Process uploaded file.
     This worker method can be used both synchronously and asynchronously.
     The returned result is useful for the synchronous case.
+
+    Rows are read in file order and persisted every PERSIST_BATCH_SIZE rows.
+    Each batch is committed along with a checkpoint: the offset in the file
+    after the batch, the rows read and the counts so far. A job interrupted
+    then claimed again resumes from its last checkpoint, and since a batch is
+    persisted and checkpointed at once, the final state does not depend on the
+    number of interruptions.
+
+    The job must be claimed by worker_id. Once lost is set, or once another
+    worker took the job over, nothing is written anymore and ClaimLostError
+    is raised.
     """
 
+    start = time.perf_counter()
+
     # get file meta data from database
     prospect_file = ProspectFileCrud.get_prospect_file_by_id(db, user_id, file_id)
 
+    file_params = {
+        "file_path": prospect_file.file_path,
+        "email_index": prospect_file.email_index,
+        "first_name_index": prospect_file.first_name_index,
+        "last_name_index": prospect_file.last_name_index,
+        "has_headers": prospect_file.has_headers,
+    }
+    force = prospect_file.force == True
+
+    # progress as of the last checkpoint, nothing for a job never started
+    checkpoint = {
+        "checkpoint_offset": prospect_file.checkpoint_offset,
+        "checkpoint_rows": prospect_file.checkpoint_rows,
+        "rows_rejected": prospect_file.rows_rejected,
+        "rows_inserted": prospect_file.rows_inserted,
+        "rows_updated": prospect_file.rows_updated,
+    }
+    initial = dict(checkpoint)
+    resumed = checkpoint["checkpoint_offset"] > 0
+
+    # a file already parsed with the same column mapping is not parsed again
+    cache_key = parsed_cache.cache_key(prospect_file.sha512_digest, file_params)
+    cached = parsed_cache.load(cache_key)
+
+    # pre-count the rows so that the total is known up front
+    if cached:
+        rows_total = cached["lines_read"]
+    elif resumed:
+        rows_total = prospect_file.rows_total
+    else:
+        rows_total = count_rows(file_params)
+
+    # publish the progress with each checkpoint
+    started_at = prospect_file.started_at or datetime.now(timezone.utc)
+    reporter = ProgressReporter(db, file_id, worker_id, rows_total, started_at, lost)
+
     # update status to in_progress
-    ProspectFileCrud.update_prospect_file(
-        db,
-        user_id,
+    reporter.publish(
+        checkpoint["checkpoint_rows"],
         {
-            "id": file_id,
+            **checkpoint,
             "status": ProspectFileStatus.in_progress,
+            "started_at": started_at,
         },
     )
 
-    # process the csv file
-    result = process_csv_file(
-        {
-            "file_path": prospect_file.file_path,
-            "email_index": prospect_file.email_index,
-            "first_name_index": prospect_file.first_name_index,
-            "last_name_index": prospect_file.last_name_index,
-            "has_headers": prospect_file.has_headers,
-        }
+    # the records after the checkpoint, the cache only holds the valid ones
+    if cached:
+        records = (
+            record
+            for record in cached["records"]
+            if record[1] > checkpoint["checkpoint_offset"]
+        )
+    else:
+        records = iter_csv_records(
+            file_params, checkpoint["checkpoint_offset"], checkpoint["checkpoint_rows"]
+        )
+
+    # a job parsing the whole file keeps the records for the cache
+    parsed = [] if not cached and not resumed and parsed_cache.enabled() else None
+
+    persist_seconds = 0.0
+
+    lines_read = checkpoint["checkpoint_rows"]
+    offset = checkpoint["checkpoint_offset"]
+    valid = lines_read - checkpoint["rows_rejected"]
+
+    # rows of the batch, see add_to_batch
+    batch: dict = {}
+
+    for lines_read, offset, prospect in records:
+        if prospect is not None:
+            valid += 1
+            add_to_batch(batch, prospect, force)
+            if parsed is not None:
+                parsed.append((lines_read, offset, prospect))
+
+        if lines_read - checkpoint["checkpoint_rows"] >= settings.PERSIST_BATCH_SIZE:
+            checkpoint.update(
+                checkpoint_offset=offset,
+                checkpoint_rows=lines_read,
+                rows_rejected=lines_read - valid,
+            )
+            persist_seconds += commit_batch(
+                db, user_id, batch, force, checkpoint, reporter
+            )
+            batch = {}
+
+    # the rows after the last valid one of a cached file are invalid ones
+    if cached:
+        lines_read = cached["lines_read"]
+
+    # persist the remainder
+    checkpoint.update(
+        checkpoint_offset=offset,
+        checkpoint_rows=lines_read,
+        rows_rejected=lines_read - valid,
     )
+    persist_seconds += commit_batch(db, user_id, batch, force, checkpoint, reporter)
 
-    # discovered prospects
-    prospects = result["prospects"]
+    if parsed is not None:
+        parsed_cache.store(
+            cache_key,
+            {
+                "records": parsed,
+                "lines_read": lines_read,
+                "rows_rejected": checkpoint["rows_rejected"],
+            },
+        )
 
-    # total number of lines in the file
-    lines_read = result["lines_read"]
+    # number of prospects created or updated
+    persisted = checkpoint["rows_inserted"] + checkpoint["rows_updated"]
 
-    # persist the prospects
-    persisted_prospects = persist(
-        db,
-        prospects,
-        {
-            "force": prospect_file.force,
-            "user_id": user_id,
-        },
+    # record the throughput of this run of the import
+    finished_at = time.perf_counter()
+    IMPORT_ROWS_PARSED.inc(lines_read - initial["checkpoint_rows"])
+    IMPORT_ROWS_REJECTED.inc(checkpoint["rows_rejected"] - initial["rows_rejected"])
+    IMPORT_ROWS_PERSISTED.inc(
+        persisted - initial["rows_inserted"] - initial["rows_updated"]
     )
+    IMPORT_DURATION.observe(finished_at - start - persist_seconds, labels=("parse",))
+    IMPORT_DURATION.observe(persist_seconds, labels=("persist",))
+    IMPORT_DURATION.observe(finished_at - start, labels=("total",))
+    if finished_at > start:
+        IMPORT_ROWS_PER_SECOND.observe(
+            (lines_read - initial["checkpoint_rows"]) / (finished_at - start)
+        )
 
     # update status (done), rows_total, and rows_done
-    ProspectFileCrud.update_prospect_file(
-        db,
-        user_id,
-        {
-            "id": file_id,
-            "rows_total": lines_read,
-            "rows_done": len(persisted_prospects),
-            "status": ProspectFileStatus.done,
-        },
-    )
+    reporter.finish(lines_read)
 
     # compose a response for synchronous option. Include HAL links (HATEOS)
     return {
         "id": file_id,
         "total": lines_read,
-        "done": len(persisted_prospects),
+        "done": lines_read,
+        "inserted": checkpoint["rows_inserted"],
+        "updated": checkpoint["rows_updated"],
+        "rejected": checkpoint["rows_rejected"],
         "status": ProspectFileStatus.done,
         "_links": {
             "self": f"/api/prospect_files/{file_id}/progress",
         },
     }
+
+
+def commit_batch(
+    db: Session,
+    user_id: int,
+    batch: dict,
+    force: bool,
+    checkpoint: dict,
+    reporter: ProgressReporter,
+) -> float:
+    """
+    Upsert a batch of prospects and write the checkpoint reached after it in
+    the same transaction. The counts of the checkpoint are updated with the
+    ones of the batch. Returns the time spent, in seconds.
+    Raises ClaimLostError, without persisting the batch, if the claim was lost.
+    """
+    started_at = time.perf_counter()
+
+    # a worker whose job was taken over must not write over the new owner
+    reporter.ensure_claimed()
+
+    inserted, updated = ProspectCrud.upsert_prospects(
+        db, user_id, list(batch.values()), force, commit=False
+    )
+    checkpoint["rows_inserted"] += inserted
+    checkpoint["rows_updated"] += updated
+    reporter.publish(checkpoint["checkpoint_rows"], checkpoint)
+
+    return time.perf_counter() - started_at
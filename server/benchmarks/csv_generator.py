@@ -0,0 +1,80 @@
+import csv
+import random
+
+# characters forcing a field to be quoted
+QUOTED_SUFFIXES = [", Jr.", ' "the boss"', ",\nline two"]
+
+INVALID_EMAILS = [
+    "not-an-email",
+    "missing-at.example.com",
+    "two@@example.com",
+    "a@",
+    "",
+]
+
+
+def generate_csv(
+    path: str,
+    rows: int,
+    columns: int = 3,
+    quote_density: float = 0.1,
+    invalid_ratio: float = 0.02,
+    duplicate_ratio: float = 0.05,
+    has_headers: bool = True,
+    domains: int = 1000,
+    seed: int = 0,
+) -> dict:
+    """
+    Write a CSV file of prospects. The same arguments always produce the same
+    file.
+
+    The email, first name and last name are the first three columns, the other
+    columns are filler. quote_density is the share of name fields which need
+    quoting (embedded commas, quotes or newlines), invalid_ratio the share of
+    invalid emails and duplicate_ratio the share of rows repeating the email
+    of an earlier row.
+
+    Returns the file_params describing the file to iter_csv_records.
+    """
+    if columns < 3:
+        raise ValueError("A prospects file has at least 3 columns")
+
+    rng = random.Random(seed)
+    emails = []
+
+    with open(path, "w", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+
+        if has_headers:
+            writer.writerow(
+                ["email", "first_name", "last_name"]
+                + [f"extra_{column}" for column in range(3, columns)]
+            )
+
+        for index in range(rows):
+            draw = rng.random()
+            if draw < invalid_ratio:
+                email = rng.choice(INVALID_EMAILS)
+            elif draw < invalid_ratio + duplicate_ratio and emails:
+                email = rng.choice(emails)
+            else:
+                email = f"user{index}@example{rng.randrange(domains)}.com"
+                emails.append(email)
+
+            first_name = f"First{index}"
+            last_name = f"Last{index}"
+            if rng.random() < quote_density:
+                last_name += rng.choice(QUOTED_SUFFIXES)
+
+            writer.writerow(
+                [email, first_name, last_name]
+                + [f"value {index}-{column}" for column in range(3, columns)]
+            )
+
+    return {
+        "file_path": path,
+        "email_index": 1,
+        "first_name_index": 2,
+        "last_name_index": 3,
+        "has_headers": has_headers,
+    }
@@ -0,0 +1,175 @@
+import argparse
+import random
+import sys
+from typing import Callable, Dict, List, Tuple
+
+from pydantic import EmailStr
+
+from api.services.row_validator import validate_domain, validate_email
+from .csv_generator import INVALID_EMAILS
+from .import_pipeline import best_of, format_rate, measure
+
+# emails on both sides of the fast path: each one must get the same result
+# from validate_email as from EmailStr.validate
+CORPUS: Dict[str, List[str]] = {
+    "common": [
+        "john.doe@example.com",
+        "a@b.co",
+        "o'brien+tag@sub.example.org",
+        "x_y-z@my-domain.io",
+        "first.middle.last@a.b.c.example.net",
+        "user{123}~!#$%&*=?^`|@example.com",
+    ],
+    "uppercase": [
+        "John.Doe@Example.COM",
+        "USER@EXAMPLE.COM",
+        "user@EXAMPLE.com",
+        "Postmaster@Example.com",
+        "POSTMASTER@example.com",
+        "Abuse@example.org",
+    ],
+    "trailing dots": [
+        "john@example.com.",
+        "john.@example.com",
+        ".john@example.com",
+        "john..doe@example.com",
+        "john@example..com",
+        "john@.example.com",
+        "john@example.com..",
+    ],
+    "idn": [
+        "user@bücher.de",
+        "user@BÜCHER.de",
+        "user@xn--bcher-kva.de",
+        "user@XN--BCHER-KVA.DE",
+        "josé@example.com",
+        "用户@例子.广告",
+        "user@straße.de",
+        "user@xn--invalid-.com",
+        "user@ex\u00admple.com",
+    ],
+    "quoted local parts": [
+        '"john doe"@example.com',
+        '"john..doe"@example.com',
+        '"john@doe"@example.com',
+        '"\\"quoted\\""@example.com',
+        '""@example.com',
+        '"john"@example.com',
+        '"John"@Example.com',
+    ],
+    "display names": [
+        "John Doe <john@example.com>",
+        '"Doe, John" <john@example.com>',
+        "John <JOHN@Example.com>",
+        "<john@example.com>",
+        "John Doe john@example.com",
+        "John Doe <john@example.com",
+    ],
+    "lengths": [
+        f"{'a' * 64}@example.com",
+        f"{'a' * 65}@example.com",
+        f"a@{'b' * 63}.com",
+        f"a@{'b' * 64}.com",
+        f"{'a' * 64}@{'b' * 63}.{'c' * 63}.{'d' * 57}.com",
+        f"{'a' * 64}@{'b' * 63}.{'c' * 63}.{'d' * 58}.com",
+    ],
+    # stripped by EmailStr
+    "whitespace": [
+        " john@example.com",
+        "john@example.com ",
+        "john@example.com\n",
+        "\tjohn@example.com",
+    ],
+    "invalid": INVALID_EMAILS
+    + [
+        "john@localhost",
+        "john@example",
+        "john@-example.com",
+        "john@example-.com",
+        "john@exa_mple.com",
+        "john@123.123.123.123",
+        "john@[127.0.0.1]",
+        "john doe@example.com",
+        "john@example.invalid",
+        "john@example.test",
+    ],
+}
+
+
+def outcome(validate: Callable[[str], str], email: str) -> Tuple[str, str]:
+    """("valid", normalized email) or ("invalid", error type)"""
+    try:
+        return "valid", validate(email)
+    except Exception as e:
+        return "invalid", type(e).__name__
+
+
+def compare(corpus: Dict[str, List[str]]) -> List[str]:
+    """The emails the fast path and EmailStr.validate disagree on"""
+    mismatches = []
+    validate_domain.cache_clear()
+    # twice: the domain is validated first, then read from the cache
+    for _ in range(2):
+        for category, emails in corpus.items():
+            for email in emails:
+                fast = outcome(validate_email, email)
+                full = outcome(EmailStr.validate, email)
+                if fast != full:
+                    mismatches.append(
+                        f"{category}: {email!r} fast path {fast}, EmailStr {full}"
+                    )
+    return mismatches
+
+
+def common_emails(count: int, domains: int, seed: int) -> List[str]:
+    """Emails of the common shape, as the CSV generator writes them"""
+    rng = random.Random(seed)
+    return [
+        f"user{index}@example{rng.randrange(domains)}.com" for index in range(count)
+    ]
+
+
+def validate_all(validate: Callable[[str], str], emails: List[str]) -> int:
+    """Validate the emails, return the number of valid ones"""
+    return sum(outcome(validate, email)[0] == "valid" for email in emails)
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(
+        description="Check the fast email validation against EmailStr and time both"
+    )
+    parser.add_argument("--emails", type=int, default=100000)
+    parser.add_argument("--domains", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    mismatches = compare(CORPUS)
+    for mismatch in mismatches:
+        print(f"MISMATCH {mismatch}")
+    print(
+        f"{sum(len(emails) for emails in CORPUS.values())} corpus emails, "
+        f"{len(mismatches)} mismatches"
+    )
+
+    edge_cases = [email for emails in CORPUS.values() for email in emails]
+    workloads = {
+        "common": common_emails(args.emails, args.domains, args.seed),
+        # the whole corpus repeated, mostly taking the EmailStr fallback
+        "corpus": edge_cases * (args.emails // len(edge_cases) + 1),
+    }
+    for workload, emails in workloads.items():
+        for name, validate in [
+            ("validate_email", validate_email),
+            ("EmailStr.validate", EmailStr.validate),
+        ]:
+            validate_domain.cache_clear()
+            seconds, _ = best_of(args.repeat, lambda: validate_all(validate, emails))
+            rate = measure(len(emails), seconds)["rows_per_second"]
+            print(f"{workload:<8} {name:<18} {format_rate(rate)} emails/s")
+
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
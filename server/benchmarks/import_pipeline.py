@@ -0,0 +1,379 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from api.core.config import settings
+from api.database import Base
+from api.models import Prospect, ProspectFile, User
+from api.schemas.prospect_file import ProspectFileStatus
+from api.services import worker
+from api.services.csv_processor import iter_csv_records, parse_row
+from .csv_generator import generate_csv
+
+# generator arguments of each scenario, on top of the defaults of generate_csv
+SCENARIOS: Dict[str, dict] = {
+    "default": {},
+    "no_header": {"has_headers": False},
+    "wide": {"columns": 20},
+    "quoted": {"quote_density": 0.9},
+    "invalid": {"invalid_ratio": 0.3},
+    "duplicates": {"duplicate_ratio": 0.5},
+}
+
+# SQLite cannot autoincrement the id of the composite primary key of the
+# prospects table, the benchmark tables use a rowid key and the same columns
+SQLITE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        email VARCHAR NOT NULL UNIQUE,
+        password_digest VARCHAR NOT NULL UNIQUE,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS prospects (
+        id INTEGER PRIMARY KEY,
+        email VARCHAR NOT NULL,
+        first_name VARCHAR NOT NULL,
+        last_name VARCHAR NOT NULL,
+        user_id INTEGER REFERENCES users (id),
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (user_id, email)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS prospect_files (
+        id INTEGER PRIMARY KEY,
+        file_name VARCHAR NOT NULL,
+        file_size BIGINT NOT NULL,
+        sha512_digest VARCHAR NOT NULL,
+        file_path VARCHAR NOT NULL,
+        email_index INTEGER NOT NULL,
+        first_name_index INTEGER,
+        last_name_index INTEGER,
+        has_headers BOOLEAN,
+        force BOOLEAN,
+        rows_total INTEGER NOT NULL,
+        rows_done INTEGER NOT NULL,
+        uploaded_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        started_at DATETIME,
+        user_id INTEGER NOT NULL REFERENCES users (id),
+        status VARCHAR NOT NULL,
+        request_id VARCHAR NOT NULL UNIQUE,
+        claimed_by VARCHAR,
+        heartbeat_at DATETIME,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        checkpoint_offset BIGINT NOT NULL DEFAULT 0,
+        checkpoint_rows INTEGER NOT NULL DEFAULT 0,
+        rows_rejected INTEGER NOT NULL DEFAULT 0,
+        rows_inserted INTEGER NOT NULL DEFAULT 0,
+        rows_updated INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+]
+
+BENCHMARK_USER = "benchmark@example.com"
+
+# the import worker running the imports of the benchmark
+BENCHMARK_WORKER = "benchmark"
+
+
+def best_of(repeat: int, run: Callable[[], object]) -> tuple:
+    """Run repeat times, return the shortest duration and the last result"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def measure(rows: int, seconds: float) -> dict:
+    return {
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds > 0 else None,
+    }
+
+
+def read_rows(file_params: dict) -> List[list]:
+    """Parse the CSV file the way iter_csv_records does, without validating"""
+    with open(
+        file_params["file_path"], newline="", buffering=settings.BUFFER_SIZE
+    ) as csvfile:
+        rows = csv.reader(csvfile, delimiter=",", quotechar='"')
+        if file_params["has_headers"]:
+            next(rows, None)
+        return list(rows)
+
+
+def validate_rows(rows: List[list], file_params: dict) -> int:
+    """Validate parsed rows, return the number of valid ones"""
+    return sum(1 for row in rows if parse_row(row, file_params) is not None)
+
+
+def prepare_database(database_url: str) -> tuple:
+    """Create the tables if needed and the benchmark user, return (engine, user id)"""
+    engine = create_engine(database_url)
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as connection:
+            for statement in SQLITE_SCHEMA:
+                connection.execute(text(statement))
+    else:
+        Base.metadata.create_all(
+            engine,
+            tables=[User.__table__, Prospect.__table__, ProspectFile.__table__],
+        )
+
+    db = sessionmaker(bind=engine)()
+    try:
+        user = db.query(User).filter(User.email == BENCHMARK_USER).first()
+        if user is None:
+            user = User(email=BENCHMARK_USER, password_digest=BENCHMARK_USER)
+            db.add(user)
+            db.commit()
+        return engine, user.id
+    finally:
+        db.close()
+
+
+def process_records(file_params: dict) -> int:
+    """Parse and validate the records of a file as the worker reads them, return the rows read"""
+    rows = 0
+    for rows, _, _ in iter_csv_records(file_params):
+        pass
+    return rows
+
+
+def create_prospect_file(engine: Engine, user_id: int, file_params: dict) -> int:
+    """Save the file as an import claimed by the benchmark worker, return its id"""
+    db = sessionmaker(bind=engine)()
+    try:
+        prospect_file = ProspectFile(
+            file_name=os.path.basename(file_params["file_path"]),
+            file_size=os.path.getsize(file_params["file_path"]),
+            sha512_digest=BENCHMARK_WORKER,
+            file_path=file_params["file_path"],
+            email_index=file_params["email_index"],
+            first_name_index=file_params["first_name_index"],
+            last_name_index=file_params["last_name_index"],
+            has_headers=file_params["has_headers"],
+            rows_total=0,
+            rows_done=0,
+            user_id=user_id,
+            status=ProspectFileStatus.in_progress,
+            request_id=uuid.uuid4().hex,
+        )
+        db.add(prospect_file)
+        db.commit()
+        return prospect_file.id
+    finally:
+        db.close()
+
+
+def run_import(engine: Engine, user_id: int, file_id: int, force: bool) -> tuple:
+    """
+    Run the import of a file from its first row, as an import worker does.
+    Returns the time it took, the time spent persisting batches along with their
+    checkpoints, and the number of prospects inserted or updated.
+    """
+    db = sessionmaker(bind=engine)()
+    try:
+        db.query(ProspectFile).filter(ProspectFile.id == file_id).update(
+            {
+                "force": force,
+                "status": ProspectFileStatus.in_progress,
+                "claimed_by": BENCHMARK_WORKER,
+                "started_at": None,
+                "checkpoint_offset": 0,
+                "checkpoint_rows": 0,
+                "rows_rejected": 0,
+                "rows_inserted": 0,
+                "rows_updated": 0,
+            }
+        )
+        db.commit()
+
+        # the worker records the time it spends persisting
+        persisted = worker.IMPORT_DURATION.summary(("persist",))["sum"]
+        start = time.perf_counter()
+        result = worker.execute(db, user_id, file_id, BENCHMARK_WORKER)
+        elapsed = time.perf_counter() - start
+        persist_seconds = (
+            worker.IMPORT_DURATION.summary(("persist",))["sum"] - persisted
+        )
+        return elapsed, persist_seconds, result["inserted"] + result["updated"]
+    finally:
+        db.close()
+
+
+def delete_prospects(engine: Engine, user_id: int) -> None:
+    db = sessionmaker(bind=engine)()
+    try:
+        db.query(Prospect).filter(Prospect.user_id == user_id).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+def run_scenario(
+    file_params: dict, databases: List[tuple], repeat: int
+) -> Dict[str, dict]:
+    """Time each stage of the import of a file"""
+    results = {}
+
+    seconds, rows = best_of(repeat, lambda: read_rows(file_params))
+    results["parse"] = measure(len(rows), seconds)
+
+    seconds, _ = best_of(repeat, lambda: validate_rows(rows, file_params))
+    results["validate"] = measure(len(rows), seconds)
+
+    # parse and validate together, as the worker does
+    seconds, lines_read = best_of(repeat, lambda: process_records(file_params))
+    results["process"] = measure(lines_read, seconds)
+
+    for dialect, engine, user_id in databases:
+        file_id = create_prospect_file(engine, user_id, file_params)
+        timings = {}
+        for _ in range(repeat):
+            delete_prospects(engine, user_id)
+            # every prospect exists after the first run, force updates them all
+            for stage, force in (("insert", False), ("update", True)):
+                elapsed, persist_seconds, done = run_import(
+                    engine, user_id, file_id, force
+                )
+                best = timings.get(stage)
+                if best is None or elapsed < best[0]:
+                    timings[stage] = (elapsed, persist_seconds, done)
+
+        delete_prospects(engine, user_id)
+        for stage, (elapsed, persist_seconds, done) in timings.items():
+            results[f"persist_{stage}[{dialect}]"] = measure(done, persist_seconds)
+            results[f"import_{stage}[{dialect}]"] = measure(lines_read, elapsed)
+
+    return results
+
+
+def format_rate(rows_per_second: Optional[float]) -> str:
+    """Format a rate of measure(), n/a for a stage too fast to be timed"""
+    if rows_per_second is None:
+        return f"{'n/a':>12}"
+    return f"{rows_per_second:>12.0f}"
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """List the stages whose rows per second dropped more than threshold below baseline"""
+    regressions = []
+    for scenario, stages in baseline["results"].items():
+        for stage, expected in stages.items():
+            current = results["results"].get(scenario, {}).get(stage)
+            if current is None or not expected["rows_per_second"]:
+                continue
+            ratio = (current["rows_per_second"] or 0) / expected["rows_per_second"]
+            if ratio < 1 - threshold:
+                regressions.append(
+                    f"{scenario} {stage}: {current['rows_per_second']:.0f} rows/s, "
+                    f"baseline {expected['rows_per_second']:.0f} rows/s ({ratio:.0%})"
+                )
+    return regressions
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the CSV import pipeline")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="scenario to run (repeatable, all by default)",
+    )
+    parser.add_argument(
+        "--database-url",
+        action="append",
+        help="database to persist into (repeatable, a temporary SQLite file by default)",
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare the results to this JSON file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="fail if rows per second drop more than this share below the baseline",
+    )
+    args = parser.parse_args(argv)
+
+    # invalid rows are logged one by one, which is not what is measured here
+    logging.disable(logging.ERROR)
+    # every run of an import parses its file, none is replayed from the cache
+    settings.PARSED_CACHE_MAX_BYTES = 0
+
+    with tempfile.TemporaryDirectory() as workdir:
+        database_urls = args.database_url or [
+            f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+        ]
+        databases = []
+        for database_url in database_urls:
+            engine, user_id = prepare_database(database_url)
+            databases.append((engine.dialect.name, engine, user_id))
+
+        results = {
+            "rows": args.rows,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "csv_parse_workers": settings.CSV_PARSE_WORKERS,
+            "results": {},
+        }
+        for scenario in args.scenario or list(SCENARIOS):
+            file_params = generate_csv(
+                os.path.join(workdir, f"{scenario}.csv"),
+                args.rows,
+                seed=args.seed,
+                **SCENARIOS[scenario],
+            )
+            results["results"][scenario] = run_scenario(
+                file_params, databases, args.repeat
+            )
+            for stage, result in results["results"][scenario].items():
+                print(
+                    f"{scenario:<12} {stage:<28} {format_rate(result['rows_per_second'])} rows/s"
+                )
+
+        for _, engine, _ in databases:
+            engine.dispose()
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,431 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+import httpx
+from sqlalchemy import insert, select
+
+from api.core.security import get_password_hash
+from api.database import SessionLocal
+from api.models import Campaign, CampaignProspect, Prospect, User
+
+PASSWORD = "load-test"
+
+CAMPAIGN_WORDS = [
+    "Spring",
+    "Summer",
+    "Autumn",
+    "Winter",
+    "Launch",
+    "Webinar",
+    "Outreach",
+    "Renewal",
+    "Enterprise",
+    "Startup",
+    "Holiday",
+    "Follow-up",
+]
+
+DEFAULT_MIX = (
+    "login=1,prospects=5,campaigns_search=3,campaign_prospects=1,import=0.2,progress=2"
+)
+
+# rows inserted per statement while seeding
+SEED_BATCH_SIZE = 5000
+
+
+def user_email(index: int) -> str:
+    return f"load{index}@example.com"
+
+
+def seed_database(
+    users: int, prospects_per_user: int, campaigns_per_user: int, campaign_size: int
+) -> None:
+    """Create the load test users with their prospects and campaigns, unless they exist"""
+    db = SessionLocal()
+    try:
+        for index in range(users):
+            email = user_email(index)
+            if db.query(User.id).filter(User.email == email).first():
+                continue
+
+            user = User(email=email, password_digest=get_password_hash(PASSWORD))
+            db.add(user)
+            db.flush()
+
+            prospects = [
+                {
+                    "email": f"prospect{n}@company{n % 500}.example.com",
+                    "first_name": f"First{n}",
+                    "last_name": f"Last{n}",
+                    "user_id": user.id,
+                }
+                for n in range(prospects_per_user)
+            ]
+            for start in range(0, len(prospects), SEED_BATCH_SIZE):
+                db.execute(
+                    insert(Prospect).values(prospects[start : start + SEED_BATCH_SIZE])
+                )
+            prospect_ids = (
+                db.execute(select(Prospect.id).where(Prospect.user_id == user.id))
+                .scalars()
+                .all()
+            )
+
+            rng = random.Random(index)
+            campaigns = [
+                {
+                    "name": f"{rng.choice(CAMPAIGN_WORDS)} {rng.choice(CAMPAIGN_WORDS)} {n}",
+                    "user_id": user.id,
+                }
+                for n in range(campaigns_per_user)
+            ]
+            if campaigns:
+                campaign_ids = (
+                    db.execute(
+                        insert(Campaign).values(campaigns).returning(Campaign.id)
+                    )
+                    .scalars()
+                    .all()
+                )
+                links = [
+                    {"campaign_id": campaign_id, "prospect_id": prospect_id}
+                    for campaign_id in campaign_ids
+                    for prospect_id in rng.sample(
+                        prospect_ids, min(campaign_size, len(prospect_ids))
+                    )
+                ]
+                for start in range(0, len(links), SEED_BATCH_SIZE):
+                    db.execute(
+                        insert(CampaignProspect).values(
+                            links[start : start + SEED_BATCH_SIZE]
+                        )
+                    )
+
+            db.commit()
+            print(f"Seeded {email}")
+    finally:
+        db.close()
+
+
+def load_users(users: int) -> List[dict]:
+    """The ids of the campaigns and of a sample of the prospects of each user"""
+    db = SessionLocal()
+    try:
+        contexts = []
+        for index in range(users):
+            user = db.query(User).filter(User.email == user_email(index)).first()
+            if user is None:
+                raise SystemExit(f"{user_email(index)} does not exist, seed first")
+            contexts.append(
+                {
+                    "email": user.email,
+                    "campaign_ids": db.execute(
+                        select(Campaign.id).where(Campaign.user_id == user.id)
+                    )
+                    .scalars()
+                    .all(),
+                    "prospect_ids": db.execute(
+                        select(Prospect.id)
+                        .where(Prospect.user_id == user.id)
+                        .limit(1000)
+                    )
+                    .scalars()
+                    .all(),
+                    "request_ids": [],
+                }
+            )
+        return contexts
+    finally:
+        db.close()
+
+
+def csv_upload() -> bytes:
+    """A small CSV file, unique so that it is never rejected as already processed"""
+    token = uuid.uuid4().hex
+    rows = "".join(
+        f"{token}.{n}@upload.example.com,First{n},Last{n}\n" for n in range(100)
+    )
+    return f"email,first_name,last_name\n{rows}".encode()
+
+
+async def login(client: httpx.AsyncClient, user: dict, rng: random.Random):
+    return await client.post(
+        "/api/login", json={"email": user["email"], "password": PASSWORD}
+    )
+
+
+async def prospects(client: httpx.AsyncClient, user: dict, rng: random.Random):
+    return await client.get(
+        "/api/prospects",
+        params={"page": rng.randrange(10), "page_size": 50},
+        headers=user["headers"],
+    )
+
+
+async def campaigns_search(client: httpx.AsyncClient, user: dict, rng: random.Random):
+    word = rng.choice(CAMPAIGN_WORDS)
+    start = rng.randrange(len(word) - 2)
+    return await client.get(
+        "/api/campaigns/search",
+        params={"query": word[start : start + 3].lower()},
+        headers=user["headers"],
+    )
+
+
+async def campaign_prospects(client: httpx.AsyncClient, user: dict, rng: random.Random):
+    if not user["campaign_ids"] or not user["prospect_ids"]:
+        return None
+    prospect_ids = rng.sample(user["prospect_ids"], min(20, len(user["prospect_ids"])))
+    return await client.post(
+        f"/api/campaigns/{rng.choice(user['campaign_ids'])}/prospects",
+        json={"prospect_ids": prospect_ids},
+        headers=user["headers"],
+    )
+
+
+async def import_file(client: httpx.AsyncClient, user: dict, rng: random.Random):
+    response = await client.post(
+        "/api/prospect_files/import",
+        files={"file": ("load.csv", csv_upload(), "text/csv")},
+        data={
+            "email_index": "1",
+            "first_name_index": "2",
+            "last_name_index": "3",
+            "has_headers": "true",
+        },
+        headers=user["headers"],
+    )
+    if response.status_code == 202:
+        user["request_ids"].append(response.json()["request_id"])
+    return response
+
+
+async def progress(client: httpx.AsyncClient, user: dict, rng: random.Random):
+    # the imports only run if import workers (worker.py) serve the database
+    if not user["request_ids"]:
+        return None
+    return await client.get(
+        f"/api/prospect_files/{rng.choice(user['request_ids'])}/progress",
+        headers=user["headers"],
+    )
+
+
+# operations of the mix, by name
+OPERATIONS: Dict[str, Callable] = {
+    "login": login,
+    "prospects": prospects,
+    "campaigns_search": campaigns_search,
+    "campaign_prospects": campaign_prospects,
+    "import": import_file,
+    "progress": progress,
+}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(
+                f"Unknown operation {name}, one of {', '.join(OPERATIONS)}"
+            )
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile(values: List[float], share: float) -> Optional[float]:
+    """Nearest rank percentile of sorted values"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(share * len(values)) - 1))]
+
+
+def summarize(samples: Dict[str, list], elapsed: float) -> Dict[str, dict]:
+    """Throughput, latency percentiles and error rate of each operation"""
+    summary = {}
+    for name, results in sorted(samples.items()):
+        latencies = sorted(latency for latency, _ in results)
+        statuses: Dict[str, int] = defaultdict(int)
+        for _, status in results:
+            statuses[str(status)] += 1
+        errors = sum(
+            count
+            for status, count in statuses.items()
+            if not status.isdigit() or int(status) >= 400
+        )
+        summary[name] = {
+            "requests": len(results),
+            "throughput": len(results) / elapsed,
+            "errors": errors,
+            "error_rate": errors / len(results),
+            "statuses": dict(statuses),
+            "latency": {
+                "mean": sum(latencies) / len(latencies),
+                "p50": percentile(latencies, 0.5),
+                "p90": percentile(latencies, 0.9),
+                "p99": percentile(latencies, 0.99),
+                "max": latencies[-1],
+            },
+        }
+    return summary
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    users: List[dict],
+    weights: Dict[str, float],
+    concurrency: int,
+    duration: float,
+    seed: int,
+) -> dict:
+    """Drive the mix with concurrency clients for duration seconds"""
+    samples: Dict[str, list] = defaultdict(list)
+    names = list(weights)
+    deadline = time.perf_counter() + duration
+
+    async def run_client(number: int) -> None:
+        rng = random.Random(seed * 100003 + number)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, [weights[name] for name in names])[0]
+            user = rng.choice(users)
+            start = time.perf_counter()
+            try:
+                response = await OPERATIONS[name](client, user, rng)
+                if response is None:
+                    # nothing to do yet, e.g. no import to track
+                    continue
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            samples[name].append((time.perf_counter() - start, status))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(number) for number in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    total = sum(len(results) for results in samples.values())
+    return {
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "requests": total,
+        "throughput": total / elapsed,
+        "endpoints": summarize(samples, elapsed),
+    }
+
+
+async def run(args) -> dict:
+    if args.target == "in-process":
+        import main
+
+        # no import worker runs in-process: the imports stay scheduled
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=main.app),
+            base_url="http://testserver",
+            timeout=args.timeout,
+        )
+    else:
+        limits = httpx.Limits(max_connections=max(args.concurrency))
+        client = httpx.AsyncClient(
+            base_url=args.target, timeout=args.timeout, limits=limits
+        )
+
+    users = load_users(args.users)
+    async with client:
+        # log every user in and queue an import to track, outside of the measures
+        for user in users:
+            response = await login(client, user, None)
+            response.raise_for_status()
+            user["headers"] = {"Authorization": f"Bearer {response.json()['token']}"}
+            if "progress" in args.mix:
+                await import_file(client, user, None)
+
+        levels = []
+        for concurrency in args.concurrency:
+            level = await run_level(
+                client, users, args.mix, concurrency, args.duration, args.seed
+            )
+            levels.append(level)
+            print(f"-- concurrency {concurrency}: {level['throughput']:.1f} req/s")
+            for name, result in level["endpoints"].items():
+                latency = result["latency"]
+                print(
+                    f"{name:<20} {result['throughput']:>8.1f} req/s"
+                    f"  p50 {latency['p50'] * 1000:>8.1f} ms"
+                    f"  p99 {latency['p99'] * 1000:>8.1f} ms"
+                    f"  errors {result['error_rate']:.1%}"
+                )
+
+    return {
+        "target": args.target,
+        "users": args.users,
+        "mix": args.mix,
+        "duration": args.duration,
+        "seed": args.seed,
+        "levels": levels,
+    }
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Load test the API endpoints")
+    parser.add_argument(
+        "--target",
+        default="in-process",
+        help="in-process, or the base URL of a running server, e.g. http://localhost:3001",
+    )
+    parser.add_argument("--seed-users", type=int, default=20)
+    parser.add_argument("--seed-prospects", type=int, default=5000)
+    parser.add_argument("--seed-campaigns", type=int, default=50)
+    parser.add_argument("--campaign-size", type=int, default=100)
+    parser.add_argument(
+        "--no-seed", action="store_true", help="use the users seeded by a previous run"
+    )
+    parser.add_argument(
+        "--users", type=int, help="number of users logged in (all the seeded ones)"
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=DEFAULT_MIX,
+        help=f"weights of the operations (default {DEFAULT_MIX})",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(level) for level in value.split(",")],
+        default=[1, 10, 50],
+        help="concurrency levels, run one after the other (default 1,10,50)",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="seconds per concurrency level"
+    )
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report to this JSON file")
+    args = parser.parse_args(argv)
+    args.users = args.users or args.seed_users
+
+    if not args.no_seed:
+        seed_database(
+            args.seed_users,
+            args.seed_prospects,
+            args.seed_campaigns,
+            args.campaign_size,
+        )
+
+    report = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,12 +1,13 @@
 import sqlalchemy
 
 from dotenv import dotenv_values
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from starlette.exceptions import HTTPException as StarletteHTTPException
-from starlette.responses import JSONResponse
-
-from api.routers import auth, prospect_files, users, campaigns, prospects
+from starlette.responses import JSONResponse, PlainTextResponse
 
+from api.core import metrics
+from api.dependencies.auth import verify_internal_token
+from api.routers import auth, prospect_files, users, campaigns, prospects, internal
 
 config = dotenv_values(".env")
 
@@ -16,16 +17,40 @@ app = FastAPI(
     version="0.0.1",
 )
 
+app.add_middleware(metrics.MetricsMiddleware)
+
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(campaigns.router)
 app.include_router(prospects.router)
 app.include_router(prospect_files.router)
+app.include_router(internal.router)
+
+
+@app.on_event("startup")
+def start_metrics():
+    metrics.start_snapshot_writer()
+
+
+@app.get(
+    "/metrics",
+    include_in_schema=False,
+    dependencies=[Depends(verify_internal_token)],
+)
+def get_metrics():
+    """Metrics of every process, in the Prometheus text exposition format"""
+    return PlainTextResponse(
+        metrics.exposition(), media_type="text/plain; version=0.0.4"
+    )
 
 
 @app.exception_handler(StarletteHTTPException)
 async def custom_http_exception_handler(_, exc):
-    return JSONResponse({"error": exc.detail}, status_code=exc.status_code)
+    return JSONResponse(
+        {"error": exc.detail},
+        status_code=exc.status_code,
+        headers=getattr(exc, "headers", None),
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,34 @@
+import sys
+
+from api.database import engine
+from api.migrations import migrate, name_of, pending_migrations
+from api.migrations.check import check
+
+if __name__ == "__main__":
+    args = sys.argv
+    command = args[1] if len(args) > 1 else "up"
+
+    if command == "up":
+        print("\n-- Applying Migrations --")
+        for name in migrate(engine):
+            print(f"...{name}")
+
+    elif command == "status":
+        print("\n-- Pending Migrations --")
+        for migration in pending_migrations(engine):
+            print(f"...{name_of(migration)}")
+
+    elif command == "check":
+        print("\n-- Checking Hot Queries Use Indexes --")
+        failed = False
+        for name, problems in check(engine):
+            if problems:
+                failed = True
+                print(f"...{name}: {'; '.join(problems)}")
+            else:
+                print(f"...{name}: ok")
+        sys.exit(1 if failed else 0)
+
+    else:
+        print(f"Unknown command {command}, use up, status or check")
+        sys.exit(2)
@@ -0,0 +1,33 @@
+import multiprocessing
+import signal
+import sys
+import threading
+
+from api.services import job_queue
+
+
+def run():
+    """Run one import worker until it receives SIGINT or SIGTERM"""
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    job_queue.run_worker(stop=stop)
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    # number of worker processes, one by default
+    processes = int(args[1]) if len(args) > 1 else 1
+
+    if processes == 1:
+        run()
+    else:
+        workers = [multiprocessing.Process(target=run) for _ in range(processes)]
+        for p in workers:
+            p.start()
+
+        # workers finish their current job before exiting
+        signal.signal(signal.SIGTERM, lambda *_: [p.terminate() for p in workers])
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for p in workers:
+            p.join()